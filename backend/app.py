@@ -1,34 +1,69 @@
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 import cv2
 import os
-import pickle
 import numpy as np
-from deepface import DeepFace
 import json
-import base64
 import time
-import random
-import string
 import re
-import speech_recognition as sr
+import subprocess
+import sys
 import threading
-from queue import Queue
+from queue import Queue, Empty
+from collections import OrderedDict, deque
+from functools import lru_cache
+from urllib.parse import quote
+from face_embedding import FaceEmbedder  # Before FER: sets TensorFlow's oneDNN flag ahead of its import
 from fer.fer import FER
+from emotion_model import QuantizedFER
+from face_gallery import FaceGallery
+from face_tracking import FaceTracker, shift_boxes_by_flow
+from frame_grabber import FrameGrabber
+
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    TURBOJPEG_AVAILABLE = True
+except ImportError:
+    TURBOJPEG_AVAILABLE = False
+    TurboJPEG = None
 
 app = Flask(__name__)
 CORS(app)
 
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+@lru_cache(maxsize=256)
+def text_size(label, scale=0.6, thickness=2):
+    """cv2.getTextSize for overlay labels - they repeat frame to frame, so memoize"""
+    return cv2.getTextSize(label, FONT, scale, thickness)[0]
+
 class FaceRecognitionAPI:
-    def __init__(self, database_path="face_database", encodings_file="face_encodings.pkl"):
+    # Phrases that introduce a name, as one compiled alternation so each
+    # transcription is scanned once. Group names number the original patterns.
+    NAME_PATTERN = re.compile(
+        r"\b(?:"
+        r"(?P<p1>this is|that'?s|meet)"
+        r"|(?P<p2>(?:(?:his|her|their) )?name is)"
+        r"|(?P<p3>s?he(?:'s| is))"
+        r"|(?P<p4>call (?:him|her|them))"
+        r") (?P<name>[a-z]+)"
+    )
+    
+    def __init__(self, database_path="face_database", encodings_file="face_encodings.npz"):
         self.database_path = database_path
         self.encodings_file = encodings_file
-        self.known_faces = {}
+        self.quantize_embeddings = False  # int8 search codes - only pays off for large galleries
+        self.distance_metric = "euclidean_l2"  # Unit-normalized embeddings, inner-product search
+        self.known_faces = FaceGallery(quantize=self.quantize_embeddings, metric=self.distance_metric)
         self.model_name = "Facenet"
-        self.recognition_threshold = 8.0  # Lowered to prevent false matches
-        self.new_face_cooldown = {}
+        # Thresholds are sqrt(2 - 2*cos) distances (the old raw-L2 8.0 / 12.0 / 8.0 rescaled)
+        self.recognition_threshold = 0.64  # Lowered to prevent false matches
+        self.uncertain_threshold = 0.96  # Below this, don't register as a new person
+        self.variance_threshold = 0.64  # Max spread of embeddings while analyzing a new face
+        self.new_face_cooldown = OrderedDict()  # track_id -> monotonic registration time, oldest first
         self.cooldown_duration = 3  # Reduced from 5 to 3 seconds
         self.pending_faces = {}  # Track faces being analyzed
+        self.pending_persons = deque()  # Auto-named Person_XXX, oldest first
         self.analysis_duration = 1.5  # Reduced from 3.0 to 1.5 seconds for faster registration
         
         # Create database directory if it doesn't exist
@@ -38,16 +73,63 @@ class FaceRecognitionAPI:
         # Load known faces
         self.load_encodings()
         
-        # Video capture
-        self.cap = None
-        self.cap_emotion = None  # Separate capture for emotion detection
+        # Recognition model (built once, run on batches of faces)
+        # (served by ONNX Runtime instead when facenet.onnx has been exported)
+        onnx_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "facenet.onnx")
+        self.embedder = FaceEmbedder(self.model_name, onnx_path=onnx_path)
+        
+        # Video capture: camera thread -> inference thread -> stream readers
+        self.grabber = FrameGrabber(0, transform=lambda f: cv2.rotate(f, cv2.ROTATE_90_COUNTERCLOCKWISE))
+        self.pipeline_lock = threading.Lock()
+        self.inference_thread = None
+        self.annotated_cond = threading.Condition()
+        self.annotated_frame = None
+        self.annotated_seq = 0
+        self.jpeg_quality = 70
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+        self.turbojpeg = None  # SIMD libjpeg-turbo encoder; cv2.imencode when unavailable
+        if TURBOJPEG_AVAILABLE:
+            try:
+                self.turbojpeg = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(f"TurboJPEG unavailable, using OpenCV JPEG encoder: {e}")
+        self.jpeg_lock = threading.Lock()
+        self.jpeg_seq = 0
+        self.jpeg_bytes = None
+        self.emotion_jpeg_cond = threading.Condition()  # Guards the cached emotion JPEG only
+        self.emotion_jpeg_busy = False  # A viewer is producing the next emotion frame
+        self.emotion_jpeg_seq = 0
+        self.emotion_jpeg_bytes = None
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.last_recognition = {}
+        self.detection_scale = 0.5  # Detection runs on a half-size image (~4x fewer pixels)
+        # YuNet CNN detector (OpenCV >= 4.8 + model file); Haar cascade otherwise
+        self.yunet_model = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_detection_yunet_2023mar.onnx")
+        self.face_detector = None
+        self.face_detector_size = None  # Input size YuNet's network is currently shaped for
+        if hasattr(cv2, 'FaceDetectorYN') and os.path.exists(self.yunet_model):
+            self.face_detector = cv2.FaceDetectorYN.create(self.yunet_model, "", (320, 320), 0.9, 0.3, 5000)
+        # Route Haar through OpenCL (T-API) when a device is available
+        self.use_opencl = cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
+        self.tracker = FaceTracker(iou_threshold=0.3, max_age=1.0)
+        self.detect_every = 3  # Run the detector every Nth frame; optical flow moves boxes in between
+        self.prev_gray = None  # Downscaled gray of the last frame, for optical flow
+        self.prev_boxes = []  # Face boxes in downscaled coordinates
+        self.last_recognition = {}  # track_id -> (name, distance, is_new)
+        self.last_processed = {}  # track_id -> time of last embedding
+        self.recheck_interval = 0.2  # Seconds between embeddings of a still-unresolved track
         self.frame_count = 0
-        self.process_every_n_frames = 5  # Reduced from 15 to 5 for more frequent processing
+        # (track_id, crop dHash) -> embedding, least recently used first; a
+        # coarse hash only stands in for a crop of the same tracked face
+        self.embedding_cache = OrderedDict()
+        self.embedding_cache_size = 64
         
         # Emotion detection
-        self.emotion_detector = FER(mtcnn=False)
+        self.emotion_motion_threshold = 3.0  # Mean 64x64 gray absdiff below this counts as "unchanged"
+        self.emotion_last_small = None
+        self.emotion_last_result = []
+        # CPU-only machines get the int8-weight TFLite copy of FER's model
+        self.emotion_detector = FER(mtcnn=False) if self.embedder.gpu_available else QuantizedFER(mtcnn=False)
         self.emotion_colors = {
             'happy': (0, 255, 0),
             'sad': (255, 0, 0),
@@ -64,50 +146,52 @@ class FaceRecognitionAPI:
         self.current_emotion = None
         self.current_emotion_confidence = 0.0
         
-        # Speech recognition
-        self.recognizer = sr.Recognizer()
-        self.recognizer.energy_threshold = 300
-        self.recognizer.dynamic_energy_threshold = True
-        self.microphone = sr.Microphone(device_index=None)
+        # Speech recognition runs in its own process (speech_worker.py); a
+        # thread here only reads its transcriptions
+        self.speech_process = None
         self.listening = False
-        self.transcription_queue = Queue()
+        self.transcription_listeners = set()  # One queue per open /api/speech/stream
+        self.listeners_lock = threading.Lock()
         self.speech_thread = None
     
     def load_encodings(self):
         """Load pre-computed face encodings from file"""
-        if os.path.exists(self.encodings_file):
-            with open(self.encodings_file, 'rb') as f:
-                self.known_faces = pickle.load(f)
+        # Changes are journaled to disk as they happen (see FaceGallery)
+        self.known_faces = FaceGallery.load(
+            self.encodings_file, quantize=self.quantize_embeddings, metric=self.distance_metric
+        )
+        self.pending_persons = deque(name for name in self.known_faces if name.startswith("Person_"))
+        # Never hand out a number that is already in use (e.g. after the counter was lost)
+        numbered = [int(name[7:]) for name in self.pending_persons if name[7:].isdigit()]
+        self.known_faces.next_id = max([self.known_faces.next_id] + numbered)
+        if len(self.known_faces) > 0:
             print(f"Loaded {len(self.known_faces)} known faces from database")
         else:
             print("No existing face database found.")
-            self.known_faces = {}
     
-    def generate_random_name(self):
-        """Generate a random name for unknown faces"""
-        random_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        name = f"Person_{random_id}"
-        
-        while name in self.known_faces:
-            random_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            name = f"Person_{random_id}"
-        
-        return name
+    def save_encodings(self):
+        """Fold the change journal into a fresh snapshot file"""
+        self.known_faces.save()
+    
+    def generate_person_name(self):
+        """Next Person_NNNNNN name for an unknown face (monotonic counter, no retries)"""
+        self.known_faces.next_id += 1
+        return f"Person_{self.known_faces.next_id:06d}"
     
-    def register_new_face(self, face_img, face_position):
-        """Automatically register a new face with a random name"""
+    def register_new_face(self, face_img, face_position, embedding=None):
+        """Automatically register a new face with an auto-numbered name"""
         try:
-            name = self.generate_random_name()
+            name = self.generate_person_name()
             
             print(f"\n[NEW FACE DETECTED] Registering as: {name}")
             
-            embedding = DeepFace.represent(face_img, model_name=self.model_name, enforce_detection=False)[0]["embedding"]
+            if embedding is None:
+                embedding = self.embedder.represent(face_img)
             
-            self.known_faces[name] = embedding
-            
-            with open(self.encodings_file, 'wb') as f:
-                pickle.dump(self.known_faces, f)
+            self.known_faces.add(name, embedding)
+            self.pending_persons.append(name)
             
+            # Save face image (served as a static file by /face_images)
             img_path = os.path.join(self.database_path, f"{name}.jpg")
             cv2.imwrite(img_path, face_img)
             
@@ -128,10 +212,15 @@ class FaceRecognitionAPI:
             return False, f"{new_name} already exists in database"
         
         try:
-            self.known_faces[new_name] = self.known_faces.pop(old_name)
+            self.known_faces.rename(old_name, new_name)
+            self.forget_pending_person(old_name)
+            if new_name.startswith("Person_"):
+                self.pending_persons.append(new_name)
             
-            with open(self.encodings_file, 'wb') as f:
-                pickle.dump(self.known_faces, f)
+            # Tracks already labelled with the old name keep following the same face
+            for track_id, (name, distance, is_new) in list(self.last_recognition.items()):
+                if name == old_name:
+                    self.last_recognition[track_id] = (new_name, distance, is_new)
             
             old_img_path = os.path.join(self.database_path, f"{old_name}.jpg")
             new_img_path = os.path.join(self.database_path, f"{new_name}.jpg")
@@ -145,41 +234,64 @@ class FaceRecognitionAPI:
         except Exception as e:
             return False, f"Error updating name: {e}"
     
-    def recognize_or_register_face(self, face_img, face_id):
-        """Recognize a face or register it if unknown"""
+    def forget_pending_person(self, name):
+        """Drop a name from the rename queue (no-op if it is not there)"""
         try:
-            embedding = DeepFace.represent(face_img, model_name=self.model_name, enforce_detection=False)[0]["embedding"]
-            
-            min_distance = float('inf')
-            recognized_name = None
+            self.pending_persons.remove(name)
+        except ValueError:
+            pass
+    
+    def get_face_image_url(self, name):
+        """URL of a registered face's JPEG, or None if it has no image"""
+        img_path = os.path.join(self.database_path, f"{name}.jpg")
+        try:
+            mtime = int(os.path.getmtime(img_path))
+        except OSError:
+            return None
+        # The mtime busts browser caches when a name is reused for a new image
+        # Names come from /api/rename, so escape any "#", "?" or "%" in them
+        return f"/face_images/{quote(f'{name}.jpg')}?v={mtime}"
+    
+    def expire_cooldowns(self, now):
+        """Drop cooldown entries older than cooldown_duration (oldest are at the front)"""
+        while self.new_face_cooldown:
+            face_id, started = next(iter(self.new_face_cooldown.items()))
+            if now - started < self.cooldown_duration:
+                break
+            del self.new_face_cooldown[face_id]
+    
+    def recognize_or_register_face(self, face_img, face_id, embedding=None, match=None):
+        """
+        Recognize a face or register it if unknown.
+        `match` is a precomputed known_faces.nearest(embedding) result.
+        """
+        try:
+            if embedding is None:
+                embedding = self.embedder.represent(face_img)
             
-            for name, known_embedding in self.known_faces.items():
-                distance = np.linalg.norm(np.array(embedding) - np.array(known_embedding))
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    recognized_name = name
+            if match is None:
+                match = self.known_faces.nearest(embedding)
+            recognized_name, min_distance = match
             
-            # Check if face is recognized (use higher threshold of 12.0 to prevent duplicate registrations)
-            if min_distance < 12.0 and recognized_name:
+            # Check if face is recognized (use the looser uncertain threshold to prevent duplicate registrations)
+            if min_distance < self.uncertain_threshold and recognized_name:
                 # Clear pending face if it was being analyzed
                 if face_id in self.pending_faces:
                     del self.pending_faces[face_id]
                 
-                # If distance is less than 8.0, it's a confident match
+                # Below the recognition threshold it's a confident match
                 if min_distance < self.recognition_threshold:
                     return recognized_name, min_distance, False
                 else:
-                    # Between 8.0 and 12.0 - likely the same person but don't register as new
+                    # Between the two thresholds - likely the same person but don't register as new
                     return f"{recognized_name} (?)", min_distance, False
             else:
-                current_time = time.time()
+                current_time = time.monotonic()
                 
                 # Check if we're in cooldown period (just registered)
+                self.expire_cooldowns(current_time)
                 if face_id in self.new_face_cooldown:
-                    last_capture_time = self.new_face_cooldown[face_id]
-                    if current_time - last_capture_time < self.cooldown_duration:
-                        return "Unknown (processing...)", min_distance, False
+                    return "Unknown (processing...)", min_distance, False
                 
                 # Track pending face for 3-second analysis
                 if face_id not in self.pending_faces:
@@ -201,17 +313,17 @@ class FaceRecognitionAPI:
                     
                     if time_elapsed >= self.analysis_duration:
                         # 3 seconds passed, verify consistency and register
-                        embeddings_array = np.array(pending_data['embeddings'])
+                        embeddings_array = np.asarray(pending_data['embeddings'], dtype=np.float32)
+                        embeddings_array /= np.linalg.norm(embeddings_array, axis=1, keepdims=True)
                         
                         # Check if embeddings are consistent (same person)
-                        avg_embedding = np.mean(embeddings_array, axis=0)
-                        max_variance = 0
-                        for emb in pending_data['embeddings']:
-                            variance = np.linalg.norm(np.array(emb) - avg_embedding)
-                            max_variance = max(max_variance, variance)
+                        avg_embedding = embeddings_array.mean(axis=0)
+                        # Squared distances, so only the largest one needs a sqrt
+                        deviations = embeddings_array - avg_embedding
+                        max_variance = float(np.sqrt(np.einsum('ij,ij->i', deviations, deviations).max()))
                         
                         # If variance is too high, reset (might be different people)
-                        if max_variance > 8.0:  # Increased from 5.0 to 8.0 to be more lenient
+                        if max_variance > self.variance_threshold:
                             print(f"[ANALYSIS] High variance detected ({max_variance:.2f}), resetting analysis")
                             del self.pending_faces[face_id]
                             return "Analyzing... (unstable)", min_distance, False
@@ -219,12 +331,14 @@ class FaceRecognitionAPI:
                         # Use the middle image for registration (most stable)
                         middle_idx = len(pending_data['images']) // 2
                         best_face_img = pending_data['images'][middle_idx]
+                        best_embedding = pending_data['embeddings'][middle_idx]
                         
                         # Register the face
-                        new_name, new_embedding = self.register_new_face(best_face_img, face_id)
+                        new_name, new_embedding = self.register_new_face(best_face_img, face_id, best_embedding)
                         
                         if new_name:
                             self.new_face_cooldown[face_id] = current_time
+                            self.new_face_cooldown.move_to_end(face_id)
                             del self.pending_faces[face_id]
                             return new_name, 0.0, True
                         else:
@@ -239,44 +353,213 @@ class FaceRecognitionAPI:
             print(f"Error in recognition: {e}")
             return "Error", float('inf'), False
     
-    def get_frame(self):
-        """Get a frame from the webcam with face recognition"""
-        if self.cap is None or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        
-        ret, frame = self.cap.read()
-        if not ret:
-            return None
-        
-        # Rotate frame 90 degrees counter-clockwise
-        frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    def start_pipeline(self):
+        """Start the camera and inference threads (once)"""
+        if self.inference_thread is not None:
+            return True  # Fast path: every streamed frame calls this
+        with self.pipeline_lock:
+            if self.inference_thread is not None:
+                return True
+            if not self.grabber.start():
+                print(f"Error: {self.grabber.last_error}")
+                return False
+            self.inference_thread = threading.Thread(target=self._inference_loop, daemon=True)
+            self.inference_thread.start()
+            return True
+    
+    def _inference_loop(self):
+        """Annotate the newest camera frame, skipping any that arrived meanwhile"""
+        seq = None
+        while self.grabber.running:
+            seq, frame = self.grabber.read(seq)
+            if frame is None:
+                continue
+            
+            try:
+                annotated = self.annotate_frame(frame.copy())
+            except Exception as e:
+                print(f"Error in inference loop: {e}")
+                continue
+            
+            with self.annotated_cond:
+                self.annotated_frame = annotated
+                self.annotated_seq += 1
+                self.annotated_cond.notify_all()
+    
+    def get_frame(self, last_seq=None, timeout=1.0):
+        """
+        Get the newest annotated frame, waiting for one newer than last_seq.
+        Returns (seq, frame); frame is None on timeout.
+        """
+        if not self.start_pipeline():
+            return last_seq, None
+        
+        last_seq = last_seq or 0
+        with self.annotated_cond:
+            self.annotated_cond.wait_for(lambda: self.annotated_seq > last_seq, timeout)
+            if self.annotated_seq <= last_seq:
+                return last_seq, None
+            return self.annotated_seq, self.annotated_frame
+    
+    def get_jpeg(self, last_seq=None, timeout=1.0):
+        """
+        Like get_frame, but JPEG-encoded. Each annotated frame is encoded
+        once no matter how many clients are streaming it.
+        Returns (seq, jpeg_bytes); jpeg_bytes is None on timeout.
+        """
+        seq, frame = self.get_frame(last_seq, timeout)
+        if frame is None:
+            return seq, None
+        
+        with self.jpeg_lock:
+            if self.jpeg_seq != seq:
+                jpeg_bytes = self.encode_jpeg(frame)
+                if jpeg_bytes is None:
+                    return seq, None
+                self.jpeg_seq, self.jpeg_bytes = seq, jpeg_bytes
+            return seq, self.jpeg_bytes
+    
+    def get_emotion_jpeg(self, last_seq=None, timeout=1.0):
+        """
+        JPEG of the newest emotion-annotated frame. Viewers share one FER run
+        and one encode per frame: one viewer at a time produces it outside the
+        lock, the rest wait for it and pick it up if it is newer than what
+        they last showed.
+        Returns (seq, jpeg_bytes); jpeg_bytes is None on timeout.
+        """
+        last_seq = last_seq or 0
+        with self.emotion_jpeg_cond:
+            if self.emotion_jpeg_busy:
+                self.emotion_jpeg_cond.wait_for(
+                    lambda: self.emotion_jpeg_seq > last_seq or not self.emotion_jpeg_busy, timeout)
+            if self.emotion_jpeg_seq > last_seq:
+                return self.emotion_jpeg_seq, self.emotion_jpeg_bytes
+            if self.emotion_jpeg_busy:
+                return last_seq, None
+            self.emotion_jpeg_busy = True
+        
+        jpeg_bytes = None
+        try:
+            seq, frame = self.get_emotion_frame(last_seq, timeout)
+            if frame is not None:
+                jpeg_bytes = self.encode_jpeg(frame)
+        finally:
+            with self.emotion_jpeg_cond:
+                self.emotion_jpeg_busy = False
+                if jpeg_bytes is not None and seq > self.emotion_jpeg_seq:
+                    self.emotion_jpeg_seq, self.emotion_jpeg_bytes = seq, jpeg_bytes
+                self.emotion_jpeg_cond.notify_all()
+        return seq, jpeg_bytes
+    
+    def encode_jpeg(self, frame):
+        """Encode a BGR frame for streaming (libjpeg-turbo if installed); None on failure"""
+        if self.turbojpeg is not None:
+            return self.turbojpeg.encode(frame, quality=self.jpeg_quality, jpeg_subsample=TJSAMP_420)
         
-        self.frame_count += 1
+        ok, buffer = cv2.imencode('.jpg', frame, self.jpeg_params)
+        return buffer.tobytes() if ok else None
+    
+    @staticmethod
+    def face_hash(face_img):
+        """64-bit difference hash of a crop: stable across near-identical frames"""
+        small = cv2.resize(cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+        return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+    
+    def detect_faces(self, small, scale, small_gray=None):
+        """
+        Face boxes (x, y, w, h) in the downscaled BGR image: YuNet if loaded,
+        else Haar (on the OpenCL device if possible) using `small_gray` if given
+        """
+        min_size, max_size = int(80 * scale), int(500 * scale)
+        
+        if self.face_detector is not None:
+            size = (small.shape[1], small.shape[0])
+            if size != self.face_detector_size:  # Reshaping the network is not free
+                self.face_detector.setInputSize(size)
+                self.face_detector_size = size
+            _, detections = self.face_detector.detect(small)
+            if detections is None:
+                return []
+            return [
+                tuple(int(v) for v in det[:4]) for det in detections
+                if min_size <= det[2] <= max_size and min_size <= det[3] <= max_size
+            ]
+        
+        small = small_gray if small_gray is not None else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         # Increased minNeighbors from 4 to 8 for more reliable detection
         # Added minSize to filter out small false positives
-        faces = self.face_cascade.detectMultiScale(
-            gray, 
-            scaleFactor=1.1, 
+        params = dict(
+            scaleFactor=1.1,
             minNeighbors=8,  # Higher value = more strict (fewer false positives)
-            minSize=(80, 80),  # Minimum face size in pixels
-            maxSize=(500, 500)  # Maximum face size to avoid detecting large objects
+            minSize=(min_size, min_size),  # Minimum face size
+            maxSize=(max_size, max_size)  # Maximum face size to avoid detecting large objects
         )
         
-        # Filter faces by aspect ratio (faces should be roughly square)
-        valid_faces = []
-        for (x, y, w, h) in faces:
-            aspect_ratio = w / float(h)
-            # Face aspect ratio should be between 0.7 and 1.3 (roughly square)
-            if 0.7 <= aspect_ratio <= 1.3:
-                valid_faces.append((x, y, w, h))
+        if self.use_opencl:
+            try:
+                return self.face_cascade.detectMultiScale(cv2.UMat(small), **params)
+            except cv2.error as e:
+                print(f"OpenCL detection failed, falling back to CPU: {e}")
+                self.use_opencl = False
+                cv2.ocl.setUseOpenCL(False)
         
-        faces = valid_faces
+        return self.face_cascade.detectMultiScale(small, **params)
+    
+    def annotate_frame(self, frame):
+        """Run face recognition on a frame and draw the results onto it"""
+        self.frame_count += 1
         
-        # Process faces periodically
-        if self.frame_count % self.process_every_n_frames == 0 and len(faces) > 0:
-            for i, (x, y, w, h) in enumerate(faces):
+        # Detect on a downscaled copy; size limits are scaled to match so the
+        # same 80-500px faces (in full-frame pixels) are found
+        scale = self.detection_scale
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        small_gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)  # Shared by Haar and optical flow
+        
+        if self.prev_gray is None or not self.prev_boxes or self.frame_count % self.detect_every == 0:
+            # Filter faces by aspect ratio (faces should be roughly square)
+            boxes = []
+            for (x, y, w, h) in self.detect_faces(small, scale, small_gray):
+                aspect_ratio = w / float(h)
+                # Face aspect ratio should be between 0.7 and 1.3 (roughly square)
+                if 0.7 <= aspect_ratio <= 1.3:
+                    boxes.append((x, y, w, h))
+        else:
+            boxes = shift_boxes_by_flow(self.prev_gray, small_gray, self.prev_boxes)
+        self.prev_gray, self.prev_boxes = small_gray, boxes
+        
+        # Map boxes back to full-resolution coordinates
+        faces = [(int(x / scale), int(y / scale), int(w / scale), int(h / scale)) for (x, y, w, h) in boxes]
+        
+        # Follow faces across frames so each person is only recognized once
+        track_ids = self.tracker.update(faces)
+        for track_id in list(self.last_recognition):
+            if track_id not in self.tracker.tracks:
+                del self.last_recognition[track_id]
+                self.last_processed.pop(track_id, None)
+        for key in [k for k in self.embedding_cache if k[0] not in self.tracker.tracks]:
+            del self.embedding_cache[key]  # That face has left
+        
+        # Embed new tracks, plus unresolved ones (still analyzing / uncertain)
+        now = time.monotonic()
+        to_process = []
+        for i, track_id in enumerate(track_ids):
+            if track_id in self.last_recognition:
+                name, distance, is_new = self.last_recognition[track_id]
+                if is_new or distance < self.recognition_threshold:
+                    continue  # Confidently identified - keep the label
+                if now - self.last_processed.get(track_id, 0) < self.recheck_interval:
+                    continue
+            to_process.append(i)
+        
+        if to_process:
+            face_ids = []
+            face_imgs = []
+            embeddings = []  # Cached embedding, or None until the batch below fills it
+            face_tensors = []
+            pending = []  # (position in embeddings, crop hash) of faces needing the model
+            for i in to_process:
+                x, y, w, h = faces[i]
                 padding = 20
                 y1 = max(0, y - padding)
                 y2 = min(frame.shape[0], y + h + padding)
@@ -284,25 +567,58 @@ class FaceRecognitionAPI:
                 x2 = min(frame.shape[1], x + w + padding)
                 face_img = frame[y1:y2, x1:x2]
                 
-                # Verify it's actually a face using DeepFace
-                try:
-                    # Quick face verification - if DeepFace can't detect a face, skip it
-                    DeepFace.extract_faces(face_img, detector_backend='opencv', enforce_detection=True)
-                    name, distance, is_new = self.recognize_or_register_face(face_img, i)
-                    self.last_recognition[i] = (name, distance, is_new)
-                except:
-                    # Not a valid face, skip this detection
-                    continue
+                # A crop of this face that looks the same as a recent one reuses its embedding
+                key = (track_ids[i], self.face_hash(face_img))
+                embedding = self.embedding_cache.get(key)
+                if embedding is not None:
+                    self.embedding_cache.move_to_end(key)
+                else:
+                    # Verify it's actually a face using DeepFace - the same detection
+                    # pass also produces the aligned model input
+                    try:
+                        face_tensors.append(self.embedder.preprocess(face_img, enforce_detection=True))
+                    except Exception:
+                        # Not a valid face, skip this detection
+                        continue
+                    pending.append((len(embeddings), key))
+                face_ids.append(track_ids[i])
+                face_imgs.append(face_img)
+                embeddings.append(embedding)
+                self.last_processed[track_ids[i]] = now
+            
+            # One forward pass for every verified, uncached face in the frame
+            try:
+                for (pos, key), embedding in zip(pending, self.embedder.embed_batch(face_tensors)):
+                    embeddings[pos] = embedding
+                    self.embedding_cache[key] = embedding
+                while len(self.embedding_cache) > self.embedding_cache_size:
+                    self.embedding_cache.popitem(last=False)
+            except Exception as e:
+                print(f"Error computing embeddings: {e}")
+            
+            # Drop faces whose embedding failed
+            kept = [k for k, embedding in enumerate(embeddings) if embedding is not None]
+            face_ids = [face_ids[k] for k in kept]
+            face_imgs = [face_imgs[k] for k in kept]
+            embeddings = [embeddings[k] for k in kept]
+            
+            # ...and one gallery search for all of them
+            matches = self.known_faces.nearest_batch(embeddings) if len(embeddings) else []
+            
+            for track_id, face_img, embedding, match in zip(face_ids, face_imgs, embeddings, matches):
+                name, distance, is_new = self.recognize_or_register_face(face_img, track_id, embedding, match)
+                self.last_recognition[track_id] = (name, distance, is_new)
         
         # Draw rectangles and labels
         for i, (x, y, w, h) in enumerate(faces):
-            if i in self.last_recognition:
-                name, distance, is_new = self.last_recognition[i]
+            if track_ids[i] in self.last_recognition:
+                name, distance, is_new = self.last_recognition[track_ids[i]]
                 
                 # Update current person data (use first detected face)
                 if i == 0:
                     self.current_person = name
-                    self.current_confidence = max(0, 100 - (distance * 10))  # Convert distance to confidence %
+                    # Convert distance to confidence % (80 points span 0..recognition_threshold)
+                    self.current_confidence = max(0, 100 - 80 * distance / self.recognition_threshold)
                 
                 if is_new:
                     color = (255, 165, 0)  # Orange
@@ -315,11 +631,11 @@ class FaceRecognitionAPI:
                 
                 label = f"{name}"
                 if not is_new:
-                    label += f" ({distance:.1f})"
+                    label += f" ({distance:.2f})"
                 
-                (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+                text_width, text_height = text_size(label)
                 cv2.rectangle(frame, (x, y-30), (x + text_width, y), color, -1)
-                cv2.putText(frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                cv2.putText(frame, label, (x, y-10), FONT, 0.6, (255, 255, 255), 2)
             else:
                 cv2.rectangle(frame, (x, y), (x+w, y+h), (128, 128, 128), 2)
         
@@ -329,35 +645,56 @@ class FaceRecognitionAPI:
             self.current_confidence = 0.0
         
         info_text = f"Known Faces: {len(self.known_faces)}"
-        cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        cv2.putText(frame, info_text, (10, 30), FONT, 0.7, (255, 255, 255), 2)
         
         return frame
     
-    def get_emotion_frame(self):
-        """Get a frame from the webcam with emotion detection"""
-        if self.cap_emotion is None or not self.cap_emotion.isOpened():
-            self.cap_emotion = cv2.VideoCapture(0)
-        
-        ret, frame = self.cap_emotion.read()
-        if not ret:
-            return None
-        
-        # Rotate frame 90 degrees counter-clockwise
-        frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    def start_camera(self):
+        """Start just the camera thread (shared by both video streams)"""
+        if self.grabber.running:
+            return True  # Fast path: every streamed frame calls this
+        with self.pipeline_lock:
+            if not self.grabber.start():
+                print(f"Error: {self.grabber.last_error}")
+                return False
+            return True
+    
+    def get_emotion_frame(self, last_seq=None, timeout=1.0):
+        """
+        Get the newest camera frame (already rotated by the grabber) with
+        emotion detection drawn on it. Returns (seq, frame); frame is None
+        on timeout.
+        """
+        if not self.start_camera():
+            return last_seq, None
+        
+        seq, frame = self.grabber.read(last_seq, timeout)
+        if frame is None:
+            return seq, None
+        frame = frame.copy()  # The grabber's frame is shared with the inference thread
         
         try:
-            # Detect emotions
-            result = self.emotion_detector.detect_emotions(frame)
-            
-            # Boost happy emotion score
-            if result:
-                for face_data in result:
-                    emotions = face_data['emotions']
-                    if 'happy' in emotions:
-                        emotions['happy'] *= 1.5
-                        total = sum(emotions.values())
-                        for emotion in emotions:
-                            emotions[emotion] /= total
+            # Skip the CNN when the scene has not changed since the last run
+            small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+            if (self.emotion_last_small is not None
+                    and cv2.absdiff(small, self.emotion_last_small).mean() < self.emotion_motion_threshold):
+                result = self.emotion_last_result
+            else:
+                # Detect emotions
+                result = self.emotion_detector.detect_emotions(frame)
+                
+                # Boost happy emotion score
+                if result:
+                    for face_data in result:
+                        emotions = face_data['emotions']
+                        if 'happy' in emotions:
+                            emotions['happy'] *= 1.5
+                            total = sum(emotions.values())
+                            for emotion in emotions:
+                                emotions[emotion] /= total
+                
+                self.emotion_last_small = small
+                self.emotion_last_result = result
             
             # Draw results
             for idx, face_data in enumerate(result):
@@ -381,9 +718,9 @@ class FaceRecognitionAPI:
                 
                 # Draw emotion label
                 label = f"{emotion_name}: {confidence:.1%}"
-                (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+                text_width, text_height = text_size(label)
                 cv2.rectangle(frame, (x, y - text_height - 10), (x + text_width + 10, y), color, -1)
-                cv2.putText(frame, label, (x + 5, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+                cv2.putText(frame, label, (x + 5, y - 5), FONT, 0.6, (0, 0, 0), 2)
             
             # Clear current emotion if no faces detected
             if len(result) == 0:
@@ -393,47 +730,30 @@ class FaceRecognitionAPI:
         except Exception as e:
             print(f"Error in emotion detection: {e}")
         
-        return frame
+        return seq, frame
     
     def release_camera(self):
         """Release the camera"""
-        if self.cap is not None:
-            self.cap.release()
-        if self.cap_emotion is not None:
-            self.cap_emotion.release()
+        self.grabber.stop()
     
     def parse_name_from_speech(self, text):
         """Extract names from speech and update database"""
         print(f"[NAME PARSE] Analyzing: '{text}'")
         
-        # Patterns to detect name mentions
-        patterns = [
-            r"(?:this is|that's|thats|meet) ([a-z]+)",
-            r"(?:his name is|her name is|their name is|name is) ([a-z]+)",
-            r"(?:he's|she's|he is|she is) ([a-z]+)",
-            r"(?:call (?:him|her|them)) ([a-z]+)",
-        ]
-        
         detected_name = None
         matched_pattern = None
-        text_lower = text.lower()
         
-        for i, pattern in enumerate(patterns):
-            match = re.search(pattern, text_lower)
-            if match:
-                detected_name = match.group(1).capitalize()
-                matched_pattern = i + 1
-                break
+        match = self.NAME_PATTERN.search(text.lower())
+        if match:
+            detected_name = match.group('name').capitalize()
+            matched_pattern = next(i for i in range(1, 5) if match.group(f'p{i}'))
         
         if detected_name:
             print(f"[NAME DETECTED]: {detected_name} (matched pattern #{matched_pattern})")
             
-            # Find the most recent Person_XXX to rename
-            person_names = [name for name in self.known_faces.keys() if name.startswith("Person_")]
-            
-            if person_names:
-                # Get the most recently added Person_XXX
-                most_recent = person_names[-1]
+            # Rename the most recently registered Person_XXX
+            if self.pending_persons:
+                most_recent = self.pending_persons[-1]
                 print(f"[ACTION] Renaming {most_recent} to {detected_name}...")
                 success, message = self.update_person_name(most_recent, detected_name)
                 if success:
@@ -445,53 +765,72 @@ class FaceRecognitionAPI:
         else:
             print(f"[NAME PARSE] No name pattern matched")
     
-    def listen_for_speech(self):
-        """Continuously listen for speech and transcribe"""
-        print("[SPEECH] Starting speech recognition...")
-        try:
-            with self.microphone as source:
-                print("[SPEECH] Adjusting for ambient noise...")
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-                print(f"[SPEECH] Ready! Energy threshold: {self.recognizer.energy_threshold}")
-        except Exception as e:
-            print(f"[SPEECH ERROR] Could not initialize microphone: {e}")
-            self.transcription_queue.put({"error": str(e)})
-            return
-        
-        while self.listening:
+    def subscribe_transcriptions(self):
+        """Register a new stream listener; every listener receives every message"""
+        listener = Queue(maxsize=100)
+        with self.listeners_lock:
+            self.transcription_listeners.add(listener)
+        return listener
+    
+    def unsubscribe_transcriptions(self, listener):
+        with self.listeners_lock:
+            self.transcription_listeners.discard(listener)
+    
+    def publish_transcription(self, data):
+        """Fan a message out to every listener (a stalled listener just misses it)"""
+        with self.listeners_lock:
+            listeners = list(self.transcription_listeners)
+        for listener in listeners:
+            if not listener.full():
+                listener.put_nowait(data)
+    
+    def listen_for_speech(self, process):
+        """Relay transcriptions from the speech worker process until it exits"""
+        for line in process.stdout:
             try:
-                with self.microphone as source:
-                    audio = self.recognizer.listen(source, timeout=None, phrase_time_limit=10)
-                    print("[SPEECH] Audio detected, processing...")
-                
-                try:
-                    text = self.recognizer.recognize_google(audio)
-                    print(f"[SPEECH] Transcribed: {text}")
-                    self.transcription_queue.put({"text": text, "timestamp": time.time()})
-                    
-                    # Parse for name mentions and auto-rename faces
-                    self.parse_name_from_speech(text)
-                    
-                except sr.UnknownValueError:
-                    print("[SPEECH] Could not understand audio")
-                except sr.RequestError as e:
-                    print(f"[SPEECH ERROR] Recognition error: {e}")
-                    self.transcription_queue.put({"error": str(e)})
-            except Exception as e:
-                if self.listening:
-                    print(f"[SPEECH ERROR] Listening error: {e}")
+                data = json.loads(line)
+            except ValueError:
+                continue
+            self.publish_transcription(data)
+            
+            # Parse for name mentions and auto-rename faces
+            if 'text' in data:
+                self.parse_name_from_speech(data['text'])
+        
+        # Worker gave up (e.g. no microphone) - allow a later start to retry
+        if process is self.speech_process:
+            self.listening = False
     
     def start_speech_recognition(self):
-        """Start speech recognition in background thread"""
+        """Start speech recognition in a background process"""
         if not self.listening:
+            print("[SPEECH] Starting speech recognition...")
+            worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speech_worker.py")
+            try:
+                self.speech_process = subprocess.Popen(
+                    [sys.executable, worker], stdout=subprocess.PIPE, text=True, bufsize=1
+                )
+            except OSError as e:
+                print(f"[SPEECH ERROR] Could not start speech worker: {e}")
+                self.publish_transcription({"error": str(e)})
+                return
             self.listening = True
-            self.speech_thread = threading.Thread(target=self.listen_for_speech, daemon=True)
+            self.speech_thread = threading.Thread(
+                target=self.listen_for_speech, args=(self.speech_process,), daemon=True
+            )
             self.speech_thread.start()
             print("[SPEECH] Speech recognition started")
     
     def stop_speech_recognition(self):
         """Stop speech recognition"""
         self.listening = False
+        if self.speech_process is not None:
+            self.speech_process.terminate()
+            try:
+                self.speech_process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.speech_process.kill()
+            self.speech_process = None
         print("[SPEECH] Speech recognition stopped")
 
 # Initialize the face recognition system
@@ -499,27 +838,24 @@ face_system = FaceRecognitionAPI()
 
 def generate_frames():
     """Generate frames for video streaming"""
+    seq = None
     while True:
-        frame = face_system.get_frame()
+        # Only new frames come back, so nothing is re-sent to the client
+        seq, frame = face_system.get_jpeg(seq)
         if frame is None:
             continue
         
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
 def generate_emotion_frames():
     """Generate frames for emotion video streaming"""
+    seq = None
     while True:
-        frame = face_system.get_emotion_frame()
+        seq, frame = face_system.get_emotion_jpeg(seq)
         if frame is None:
             continue
         
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
@@ -540,25 +876,21 @@ def get_faces():
     """Get all registered faces"""
     faces = []
     for name in face_system.known_faces.keys():
-        img_path = os.path.join(face_system.database_path, f"{name}.jpg")
-        if os.path.exists(img_path):
-            with open(img_path, 'rb') as f:
-                img_data = base64.b64encode(f.read()).decode('utf-8')
-                faces.append({
-                    'name': name,
-                    'image': img_data
-                })
-        else:
-            faces.append({
-                'name': name,
-                'image': None
-            })
+        faces.append({
+            'name': name,
+            'url': face_system.get_face_image_url(name)
+        })
     
     return jsonify({
         'faces': faces,
         'count': len(faces)
     })
 
+@app.route('/face_images/<path:filename>', methods=['GET'])
+def get_face_image(filename):
+    """Serve a registered face's JPEG (conditional requests / ETag handled by Flask)"""
+    return send_from_directory(os.path.abspath(face_system.database_path), filename, max_age=3600)
+
 @app.route('/api/rename', methods=['POST'])
 def rename_face():
     """Rename a person in the database"""
@@ -589,12 +921,14 @@ def delete_face():
         return jsonify({'success': False, 'message': f'{name} not found in database'}), 404
     
     try:
-        # Remove from dictionary
-        del face_system.known_faces[name]
+        # Remove from gallery
+        face_system.known_faces.remove(name)
+        face_system.forget_pending_person(name)
         
-        # Save updated encodings
-        with open(face_system.encodings_file, 'wb') as f:
-            pickle.dump(face_system.known_faces, f)
+        # Make tracks showing this person recognize again
+        for track_id, recognition in list(face_system.last_recognition.items()):
+            if recognition[0] == name:
+                del face_system.last_recognition[track_id]
         
         # Delete image file
         img_path = os.path.join(face_system.database_path, f"{name}.jpg")
@@ -645,12 +979,21 @@ def stop_speech():
 @app.route('/api/speech/stream')
 def speech_stream():
     """Stream transcribed text using Server-Sent Events"""
+    listener = face_system.subscribe_transcriptions()
+    
     def generate():
-        while True:
-            if not face_system.transcription_queue.empty():
-                data = face_system.transcription_queue.get()
-                yield f"data: {json.dumps(data)}\\n\\n"
-            time.sleep(0.1)
+        try:
+            while True:
+                try:
+                    # Block until a transcription arrives instead of polling
+                    data = listener.get(timeout=15)
+                    yield f"data: {json.dumps(data)}\n\n"
+                except Empty:
+                    # SSE comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+        finally:
+            # Client disconnected (generator closed)
+            face_system.unsubscribe_transcriptions(listener)
     
     return Response(generate(), mimetype='text/event-stream')
 
@@ -660,3 +1003,4 @@ if __name__ == '__main__':
     finally:
         face_system.stop_speech_recognition()
         face_system.release_camera()
+        face_system.save_encodings()
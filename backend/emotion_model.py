@@ -0,0 +1,104 @@
+"""
+Emotion Model
+FER with its emotion CNN converted to a weight-quantized TFLite model, so
+CPU-only machines classify faces with int8 weights (4x fewer weight bytes)
+instead of the full float32 Keras model.
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from fer.fer import FER, PADDING
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    Interpreter = tf.lite.Interpreter
+
+
+# FER's classifier takes 64x64 grayscale crops, grown by FER's default offsets
+EMOTION_INPUT_SIZE = (64, 64)
+FACE_OFFSETS = (10, 10)
+
+
+def preprocess_faces(detector, img, offsets=FACE_OFFSETS):
+    """
+    Face boxes in a BGR image and their emotion-classifier inputs, prepared
+    the way ``FER.detect_emotions`` does (offset, resize, scale to [-1, 1]),
+    so faces from several frames can be stacked into a single
+    ``_classify_emotions`` call.
+
+    Returns:
+        (boxes, gray_faces) - parallel lists
+    """
+    x_off, y_off = offsets
+    boxes, gray_faces = [], []
+    gray_img = detector.pad(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    for box in detector.find_faces(img, bgr=True):
+        x, y, w, h = detector.tosquare(box)
+        x1, x2 = x - x_off + PADDING, x + w + x_off + PADDING
+        y1, y2 = y - y_off + PADDING, y + h + y_off + PADDING
+        gray_face = gray_img[max(0, y1):y2, max(0, x1):x2]
+        if gray_face.size == 0:
+            continue
+        gray_face = cv2.resize(gray_face, EMOTION_INPUT_SIZE).astype(np.float32) / 255.0
+        boxes.append(box)
+        gray_faces.append((gray_face - 0.5) * 2.0)
+    return boxes, gray_faces
+
+
+class QuantizedFER(FER):
+    """
+    Drop-in ``FER`` whose ``_classify_emotions`` runs a TFLite interpreter.
+
+    The Keras model FER loads is converted once with post-training
+    dynamic-range quantization and cached next to this file; later starts
+    just load the .tflite file. If conversion fails, the Keras model is used.
+    """
+
+    def __init__(self, *args, tflite_path=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tflite_path = tflite_path or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "emotion_model_int8.tflite"
+        )
+        self._interpreter = None
+        self._interpreter_lock = threading.Lock()  # Interpreters are not thread-safe
+        self._batch_size = None
+
+        if not self.tfserving:
+            try:
+                self._interpreter = self._load_interpreter()
+            except Exception as e:
+                print(f"⚠️  TFLite emotion model unavailable, using Keras: {e}")
+
+    def _load_interpreter(self):
+        if not os.path.exists(self.tflite_path):
+            converter = tf.lite.TFLiteConverter.from_keras_model(self._FER__emotion_classifier)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            with open(self.tflite_path, 'wb') as f:
+                f.write(converter.convert())
+            print(f"✓ Converted emotion model to {self.tflite_path}")
+
+        interpreter = Interpreter(model_path=self.tflite_path)
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def _classify_emotions(self, gray_faces):
+        if self._interpreter is None:
+            return super()._classify_emotions(gray_faces)
+
+        batch = np.ascontiguousarray(gray_faces, dtype=np.float32)[..., np.newaxis]
+        with self._interpreter_lock:
+            input_index = self._interpreter.get_input_details()[0]['index']
+            if self._batch_size != len(batch):
+                self._interpreter.resize_tensor_input(input_index, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+
+            self._interpreter.set_tensor(input_index, batch)
+            self._interpreter.invoke()
+            output_index = self._interpreter.get_output_details()[0]['index']
+            return self._interpreter.get_tensor(output_index).copy()
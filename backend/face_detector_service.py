@@ -5,29 +5,52 @@ Updates active_session table with current customer_id.
 """
 import os
 import sys
+import threading
 import time
-import pickle
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from pathlib import Path
+from queue import Empty, Full, Queue
 from dotenv import load_dotenv
 import cv2
 import numpy as np
-from deepface import DeepFace
 from supabase import create_client
+from face_embedding import FaceEmbedder
+from face_gallery import FaceGallery
+from face_tracking import iou_matrix
+from frame_grabber import FrameGrabber
 
 # Load environment
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
 class FaceDetectorService:
-    def __init__(self, supabase_url, supabase_key, encodings_file="face_encodings.pkl"):
+    def __init__(self, supabase_url, supabase_key, encodings_file="face_encodings.npz"):
         self.encodings_file = encodings_file
-        self.known_faces = {}
+        self.distance_metric = "euclidean_l2"  # Unit-normalized embeddings, inner-product search
+        self.quantize_embeddings = True  # Read-only gallery: int8 codes are built once and reused
+        self.known_faces = FaceGallery(quantize=self.quantize_embeddings, metric=self.distance_metric)
         self.model_name = "Facenet"
-        self.recognition_threshold = 10.0
+        # sqrt(2 - 2*cos) distance, i.e. cosine similarity above 0.68 (the old raw-L2 10.0 rescaled)
+        self.recognition_threshold = 0.80
 
         # Supabase client
         self.supabase = create_client(supabase_url, supabase_key)
 
+        # Local mirror of the active_session row, refreshed by a background
+        # thread so the detection loop never waits on the network
+        self._session = {'status': 'active', 'current_customer_id': None}
+        self.session_poll_interval = 1.0
+        self._stop_event = threading.Event()
+
+        # Writes go through one background worker (so they stay in order)
+        # and repeated identical confidence_level writes are coalesced
+        self._io = ThreadPoolExecutor(max_workers=1)
+        self._last_write = (None, 0.0)  # (confidence_level, monotonic time) of the last write
+        self._pending_customer_id = None  # Queued current_customer_id write not yet confirmed
+        self._customer_writes = 0  # Confirmed current_customer_id writes; stale polls are discarded
+        self.write_debounce = 2.0
+
         # Detection stability tracking
         self.current_detected_face = None
         self.face_detection_start_time = None
@@ -36,49 +59,188 @@ class FaceDetectorService:
         # Load known faces
         self.load_encodings()
 
-        # Video capture
-        self.cap = None
+        # Model built once (ONNX Runtime session if facenet.onnx was exported)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.embedder = FaceEmbedder(self.model_name, onnx_path=os.path.join(base_dir, "facenet.onnx"))
+
+        # Video capture (camera read on its own thread, newest frame only)
+        self.grabber = None
+        self.process_interval = 0.5  # Seconds between processed frames (~2 fps)
+        # Detection -> recognition hand-off; holds only the newest (crop, box)
+        # (None means "no face in frame")
+        self.face_q = Queue(maxsize=1)
+        # Crop dHash -> (name, distance), least recently used first; only
+        # touched by the recognizer thread and cleared when the face leaves
+        self.recognition_cache = OrderedDict()
+        self.recognition_cache_size = 64
+        # A crop that isn't an exact cache hit may still reuse the previous
+        # crop's customer, but only if it is the same face: the box barely
+        # moved and the hash is within a few bits
+        self.hash_tolerance = 3  # Max differing dHash bits
+        self.continuity_iou = 0.5  # Min box overlap with the previous crop
+        self._last_key = None  # Hash and box of the previous recognized crop
+        self._last_box = None
+        self.detection_scale = 0.5  # Detection runs on a half-size image (~4x fewer pixels)
+
+        # YuNet CNN detector (OpenCV >= 4.8 + model file); Haar cascade otherwise
+        self.yunet_model = os.path.join(base_dir, "face_detection_yunet_2023mar.onnx")
+        self.face_detector = None
+        self.face_detector_size = None  # Input size YuNet's network is currently shaped for
+        if hasattr(cv2, 'FaceDetectorYN') and os.path.exists(self.yunet_model):
+            self.face_detector = cv2.FaceDetectorYN.create(self.yunet_model, "", (320, 320), 0.9, 0.3, 5000)
+            print("✅ Using YuNet face detector")
         self.face_cascade = cv2.CascadeClassifier(
             cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
         )
+        # Route the Haar path through OpenCL (T-API) when a device is available
+        self.use_opencl = self.face_detector is None and cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
 
     def load_encodings(self):
         """Load pre-computed face encodings from file"""
-        if os.path.exists(self.encodings_file):
-            with open(self.encodings_file, 'rb') as f:
-                self.known_faces = pickle.load(f)
+        self.known_faces = FaceGallery.load(
+            self.encodings_file, quantize=self.quantize_embeddings, metric=self.distance_metric
+        )
+        if len(self.known_faces) > 0:
             print(f"✅ Loaded {len(self.known_faces)} known faces")
         else:
             print("⚠️  No face encodings found. Register faces first.")
 
-    def recognize_face(self, face_img):
-        """Recognize a face using DeepFace"""
-        try:
-            embedding = DeepFace.represent(
-                face_img,
-                model_name=self.model_name,
-                enforce_detection=False
-            )[0]["embedding"]
+    def detect_faces(self, frame):
+        """
+        Face boxes (x, y, w, h) in full-frame coordinates: YuNet if loaded,
+        else Haar, run on a frame downscaled by detection_scale
+        """
+        scale = self.detection_scale
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_size = int(80 * scale)
+
+        if self.face_detector is not None:
+            size = (small.shape[1], small.shape[0])
+            if size != self.face_detector_size:  # Reshaping the network is not free
+                self.face_detector.setInputSize(size)
+                self.face_detector_size = size
+            _, detections = self.face_detector.detect(small)
+            if detections is None:
+                return []
+            boxes = [det[:4] for det in detections if det[2] >= min_size and det[3] >= min_size]
+        else:
+            boxes = self._detect_haar(small, min_size)
 
-            min_distance = float('inf')
-            recognized_name = None
+        # Crops come from the full-resolution frame for a better embedding
+        return [tuple(int(v / scale) for v in box) for box in boxes]
+
+    def _detect_haar(self, small, min_size):
+        """Haar cascade on a downscaled BGR frame, on the OpenCL device if possible"""
+        params = dict(scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+
+        if self.use_opencl:
+            try:
+                # Color conversion and detection both run on the device
+                ugray = cv2.cvtColor(cv2.UMat(small), cv2.COLOR_BGR2GRAY)
+                return self.face_cascade.detectMultiScale(ugray, **params)
+            except cv2.error as e:
+                print(f"OpenCL detection failed, falling back to CPU: {e}")
+                self.use_opencl = False
+                cv2.ocl.setUseOpenCL(False)
+
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return self.face_cascade.detectMultiScale(gray, **params)
+
+    @staticmethod
+    def face_hash(face_img):
+        """64-bit difference hash of a crop: stable across near-identical frames"""
+        small = cv2.resize(cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+        return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+
+    def _continues_last_face(self, key, box):
+        """
+        True if a crop with hash `key` at `box` is the previous recognized
+        customer's face, barely changed - a different person stepping into
+        the frame fails the box overlap even if their coarse hash is close
+        """
+        if self._last_key is None or self._last_box is None or box is None:
+            return False
+        name, _ = self.recognition_cache.get(self._last_key, (None, None))
+        if name is None:
+            return False  # Never reuse "unknown" for a merely similar crop
+        if bin(key ^ self._last_key).count('1') > self.hash_tolerance:
+            return False
+        return iou_matrix([box], [self._last_box])[0, 0] >= self.continuity_iou
+
+    def recognize_face(self, face_img, box=None):
+        """
+        Recognize a face with the preloaded embedding model (cached for
+        near-identical crops). `box` is the crop's (x, y, w, h) in the frame.
+        """
+        try:
+            key = int.from_bytes(self.face_hash(face_img), 'big')
+            if key not in self.recognition_cache and self._continues_last_face(key, box):
+                key = self._last_key
+            self._last_box = box
+            if key in self.recognition_cache:
+                self._last_key = key
+                self.recognition_cache.move_to_end(key)
+                return self.recognition_cache[key]
 
-            for name, known_embedding in self.known_faces.items():
-                distance = np.linalg.norm(np.array(embedding) - np.array(known_embedding))
+            embedding = self.embedder.represent(face_img)
 
-                if distance < min_distance:
-                    min_distance = distance
-                    recognized_name = name
+            # One matrix-vector product over the gallery's normalized (N, D) matrix
+            recognized_name, min_distance = self.known_faces.nearest(embedding)
 
             if min_distance < self.recognition_threshold and recognized_name:
-                return recognized_name, min_distance
+                result = recognized_name, min_distance
             else:
-                return None, min_distance
+                result = None, min_distance
+
+            self.recognition_cache[key] = result
+            self._last_key = key
+            while len(self.recognition_cache) > self.recognition_cache_size:
+                self.recognition_cache.popitem(last=False)
+            return result
 
         except Exception as e:
             print(f"Error in recognition: {e}")
             return None, float('inf')
 
+    def _watch_session(self):
+        """Poll the active_session row into self._session until stopped"""
+        while not self._stop_event.is_set():
+            try:
+                writes = self._customer_writes
+                result = self.supabase.table('active_session').select(
+                    'status, current_customer_id'
+                ).eq('id', 1).execute()
+                # A customer write queued or landed during the poll makes this row stale
+                if result.data and writes == self._customer_writes and self._pending_customer_id is None:
+                    self._session = result.data[0]  # Swapped whole, readers never see half a row
+            except Exception:
+                pass  # Keep the last known state
+            self._stop_event.wait(self.session_poll_interval)
+
+    def _write_session(self, fields):
+        """Queue an active_session update; identical confidence levels within write_debounce are dropped"""
+        now = time.monotonic()
+        level = fields.get('confidence_level')
+        last_level, last_time = self._last_write
+        if level == last_level and 'current_customer_id' not in fields and now - last_time < self.write_debounce:
+            return
+        self._last_write = (level, now)
+
+        def write():
+            try:
+                self.supabase.table('active_session').update(fields).eq('id', 1).execute()
+                if 'current_customer_id' in fields:
+                    self._session = {**self._session, 'current_customer_id': fields['current_customer_id']}
+                    self._customer_writes += 1
+            except Exception as e:
+                print(f"Error updating active_session: {e}")
+            finally:
+                if self._pending_customer_id == fields.get('current_customer_id'):
+                    self._pending_customer_id = None  # Confirmed, or failed and free to retry
+
+        self._io.submit(write)
+
     def update_active_session(self, customer_id):
         """Update active_session with stability check (5 seconds)"""
         current_time = time.time()
@@ -91,13 +253,7 @@ class FaceDetectorService:
             print(f"🔍 New face: {customer_id} (tracking...)")
 
             # Update as "detecting"
-            try:
-                self.supabase.table('active_session').update({
-                    'confidence_level': 'detecting',
-                }).eq('id', 1).execute()
-            except Exception as e:
-                print(f"Error updating: {e}")
-
+            self._write_session({'confidence_level': 'detecting'})
             return
 
         # Same face - check stability
@@ -105,20 +261,60 @@ class FaceDetectorService:
 
         if time_elapsed >= self.stable_detection_duration:
             # Stable for 5 seconds - lock it in
-            try:
-                result = self.supabase.table('active_session').select('current_customer_id').eq('id', 1).execute()
-                current_db_customer = result.data[0]['current_customer_id'] if result.data else None
+            current_db_customer = self._session.get('current_customer_id')
 
-                if current_db_customer != customer_id:
-                    self.supabase.table('active_session').update({
-                        'current_customer_id': customer_id,
-                        'confidence_level': 'stable',
-                    }).eq('id', 1).execute()
+            if customer_id not in (current_db_customer, self._pending_customer_id):
+                # Remembered until the write lands so the next frame doesn't queue it again
+                self._pending_customer_id = customer_id
+                self._write_session({
+                    'current_customer_id': customer_id,
+                    'confidence_level': 'stable',
+                })
 
-                    print(f"✅ LOCKED: {customer_id} (stable for {time_elapsed:.1f}s)")
+                print(f"✅ LOCKED: {customer_id} (stable for {time_elapsed:.1f}s)")
 
-            except Exception as e:
-                print(f"Error locking customer: {e}")
+    def _hand_off(self, face):
+        """Give the recognizer the newest (crop, box), replacing one it hasn't picked up yet"""
+        try:
+            self.face_q.get_nowait()
+        except Empty:
+            pass
+        try:
+            self.face_q.put_nowait(face)
+        except Full:
+            pass
+
+    def _recognition_loop(self):
+        """Embed and recognize crops from face_q; owns all detection-stability state"""
+        while not self._stop_event.is_set():
+            try:
+                face = self.face_q.get(timeout=0.5)
+            except Empty:
+                continue
+
+            if face is not None:
+                # Recognize
+                customer_id, distance = self.recognize_face(*face)
+
+                if customer_id:
+                    self.update_active_session(customer_id)
+            else:
+                # No face detected - reset tracking
+                if self.current_detected_face is not None:
+                    print("⚠️  No face detected, resetting...")
+                    self.current_detected_face = None
+                    self.face_detection_start_time = None
+                    self.recognition_cache.clear()
+                self._last_key = self._last_box = None
+
+    def _open_camera(self):
+        """Start capturing; returns False if the camera can't be opened"""
+        return self.grabber.start()
+
+    def _close_camera(self):
+        """Release the camera and forget the face being tracked"""
+        self.grabber.stop()
+        self._hand_off(None)  # The recognizer resets its tracking state
 
     def run(self):
         """Main detection loop"""
@@ -128,72 +324,71 @@ class FaceDetectorService:
         print("Monitoring for faces...")
         print("Press Ctrl+C to stop\n")
 
-        # Open camera
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
+        # Open camera - no need for more pixels than an 80px face
+        # Frames are only decoded about twice per processing interval
+        self.grabber = FrameGrabber(0, frame_size=(640, 480), min_interval=self.process_interval / 2)
+        if not self._open_camera():
             print("❌ Could not open webcam")
             return
 
-        frame_count = 0
-        process_every_n_frames = 15  # Process every 15th frame (~2 fps)
+        seq = None
+        self._stop_event.clear()
+        threading.Thread(target=self._watch_session, daemon=True).start()
+        recognizer = threading.Thread(target=self._recognition_loop, daemon=True)
+        recognizer.start()
+        next_time = time.monotonic()
 
         try:
             while True:
-                # Check if session is still active
-                try:
-                    result = self.supabase.table('active_session').select('status').eq('id', 1).execute()
-                    if result.data and result.data[0]['status'] != 'active':
-                        print("⚠️  Session not active, waiting...")
+                # Check if session is still active (local mirror, no round-trip)
+                if self._session.get('status') != 'active':
+                    if self.grabber.running:
+                        # Stop capturing and decoding while nobody is in a call
+                        print("⚠️  Session not active, releasing camera...")
+                        self._close_camera()
+                    time.sleep(self.session_poll_interval)
+                    continue
+
+                if not self.grabber.running:
+                    print("🎥 Session active, reopening camera...")
+                    if not self._open_camera():
+                        print(f"❌ {self.grabber.last_error}")
                         time.sleep(2)
                         continue
-                except:
-                    pass
 
-                ret, frame = self.cap.read()
-                if not ret:
+                # Pace detection by wall clock; recognition runs on its own thread
+                time.sleep(max(0.0, next_time - time.monotonic()))
+                next_time = time.monotonic() + self.process_interval
+
+                # Newest frame only - the camera never backs up behind recognition
+                seq, frame = self.grabber.read(seq, timeout=1.0)
+                if frame is None:
                     continue
 
-                frame_count += 1
-
-                # Process periodically
-                if frame_count % process_every_n_frames == 0:
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    faces = self.face_cascade.detectMultiScale(
-                        gray,
-                        scaleFactor=1.1,
-                        minNeighbors=5,
-                        minSize=(80, 80)
-                    )
-
-                    if len(faces) > 0:
-                        # Take first face
-                        x, y, w, h = faces[0]
-                        padding = 20
-                        y1 = max(0, y - padding)
-                        y2 = min(frame.shape[0], y + h + padding)
-                        x1 = max(0, x - padding)
-                        x2 = min(frame.shape[1], x + w + padding)
-                        face_img = frame[y1:y2, x1:x2]
-
-                        # Recognize
-                        customer_id, distance = self.recognize_face(face_img)
-
-                        if customer_id:
-                            self.update_active_session(customer_id)
-                    else:
-                        # No face detected - reset tracking
-                        if self.current_detected_face is not None:
-                            print("⚠️  No face detected, resetting...")
-                            self.current_detected_face = None
-                            self.face_detection_start_time = None
-
-                time.sleep(0.05)  # Small delay
+                faces = self.detect_faces(frame)
+
+                face = None
+                if len(faces) > 0:
+                    # Take first face
+                    x, y, w, h = faces[0]
+                    x, y = max(0, x), max(0, y)  # YuNet boxes can start off-frame
+                    padding = 20
+                    y1 = max(0, y - padding)
+                    y2 = min(frame.shape[0], y + h + padding)
+                    x1 = max(0, x - padding)
+                    x2 = min(frame.shape[1], x + w + padding)
+                    face = (frame[y1:y2, x1:x2], (x, y, w, h))
+
+                self._hand_off(face)
 
         except KeyboardInterrupt:
             print("\n\n⚠️  Stopped by user")
         finally:
-            if self.cap:
-                self.cap.release()
+            self._stop_event.set()
+            recognizer.join(timeout=2.0)
+            self._io.shutdown(wait=True)  # Flush queued writes
+            if self.grabber and self.grabber.running:
+                self._close_camera()
             print("✅ Face detector stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+Face Embedding
+Builds the DeepFace recognition model once and runs it on batches of face
+crops, so K faces in a frame cost one forward pass instead of K.
+
+Run ``python face_embedding.py facenet.onnx`` once (needs tf2onnx) to export
+the model for ONNX Runtime.
+"""
+
+import os
+import threading
+
+# oneDNN (AVX2/AVX-512 kernels) must be chosen before TensorFlow is imported
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+
+import numpy as np
+import tensorflow as tf
+from deepface import DeepFace
+from deepface.basemodels import ArcFace, Facenet, Facenet512, VGGFace
+from deepface.commons import functions
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    ort = None
+
+# Fastest first; whatever this onnxruntime build lacks is skipped
+ONNX_PROVIDERS = ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"]
+
+# Loaders for the models that may be built in mixed precision. These are
+# built outside DeepFace.build_model's singleton so an fp16 copy never
+# leaks into (or is shadowed by) plain DeepFace.represent calls.
+_FP16_LOADERS = {
+    "Facenet": Facenet.loadModel,
+    "Facenet512": Facenet512.loadModel,
+    "ArcFace": ArcFace.loadModel,
+    "VGG-Face": VGGFace.loadModel,
+}
+_fp16_models = {}  # model_name -> model, built once per process
+_fp16_lock = threading.Lock()
+
+
+def configure_cpu_threads(intra_op=None, inter_op=2):
+    """
+    Pin TensorFlow's thread pools: one intra-op thread per core and a small
+    inter-op pool, so the threaded Flask server doesn't oversubscribe CPUs.
+    Only takes effect before TensorFlow's runtime has started.
+    """
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op or os.cpu_count() or 1)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        print(f"Could not set TensorFlow thread pools: {e}")
+
+
+def configure_gpu_memory():
+    """
+    Let TensorFlow grow its GPU allocation on demand instead of reserving
+    all GPU memory up front, so FER and ONNX Runtime can share the device.
+    Only takes effect before TensorFlow's runtime has started.
+    """
+    for gpu in tf.config.list_physical_devices('GPU'):
+        try:
+            tf.config.experimental.set_memory_growth(gpu, True)
+        except RuntimeError as e:
+            print(f"Could not enable GPU memory growth: {e}")
+
+
+class FaceEmbedder:
+    """
+    Batched replacement for ``DeepFace.represent``.
+
+    Preprocessing goes through the same ``functions.extract_faces`` call that
+    DeepFace.represent uses (detect, align, resize with padding, scale to
+    [0, 1]), so embeddings match the ones already stored in the database.
+
+    On a GPU the model is built under the ``mixed_float16`` policy (tensor
+    cores); on CPU it stays float32, where fp16 would only be slower. The
+    Keras model runs as one traced ``tf.function`` graph rather than layer
+    by layer in eager mode.
+
+    Batches of up to MAX_BATCH faces are assembled in one preallocated
+    input buffer instead of a fresh array per call.
+
+    If ``onnx_path`` points at an exported model and onnxruntime is
+    installed, inference runs in an ONNX Runtime session (TensorRT / CUDA
+    execution providers when available) and the Keras model is not built.
+    """
+
+    MAX_BATCH = 8
+
+    def __init__(self, model_name="Facenet", detector_backend="opencv", use_fp16=True, warmup=True,
+                 onnx_path=None):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        configure_cpu_threads()
+        configure_gpu_memory()
+        self.gpu_available = len(tf.config.list_physical_devices('GPU')) > 0
+        self.fp16 = use_fp16 and self.gpu_available and model_name in _FP16_LOADERS
+        self.model = None
+        self.session = None
+
+        if onnx_path and ONNXRUNTIME_AVAILABLE and os.path.exists(onnx_path):
+            available = ort.get_available_providers()
+            providers = [p for p in ONNX_PROVIDERS if p in available]
+            self.session = ort.InferenceSession(onnx_path, providers=providers)
+            self.fp16 = False
+            model_input = self.session.get_inputs()[0]
+            self._onnx_input = model_input.name
+            self.target_size = tuple(int(d) for d in model_input.shape[1:3])
+            self.dim = int(self.session.get_outputs()[0].shape[-1])
+        else:
+            if self.fp16:
+                self.model = self._build_fp16_model(model_name)
+            else:
+                # DeepFace keeps one instance per model name
+                self.model = DeepFace.build_model(model_name)
+            self.target_size = tuple(self.model.input_shape[1:3])
+            self.dim = int(self.model.output_shape[-1])
+            # Any batch size reuses the one graph traced in warmup()
+            self._graph = tf.function(
+                lambda batch: self.model(batch, training=False),
+                input_signature=[tf.TensorSpec((None, *self.target_size, 3), tf.float32)]
+            )
+
+        self._batch_buf = np.empty((self.MAX_BATCH, *self.target_size, 3), dtype=np.float32)
+        self._batch_lock = threading.Lock()
+
+        if warmup:
+            self.warmup()
+
+    @staticmethod
+    def _build_fp16_model(model_name):
+        """Build (once per process) a mixed-precision copy of the model"""
+        with _fp16_lock:
+            if model_name not in _fp16_models:
+                # Only this model is built in mixed precision - restore the
+                # global policy so FER and anything else stays float32
+                previous_policy = tf.keras.mixed_precision.global_policy()
+                tf.keras.mixed_precision.set_global_policy('mixed_float16')
+                try:
+                    _fp16_models[model_name] = _FP16_LOADERS[model_name]()
+                finally:
+                    tf.keras.mixed_precision.set_global_policy(previous_policy)
+            return _fp16_models[model_name]
+
+    def warmup(self):
+        """Run one dummy forward pass so the first real face doesn't pay graph tracing / cuDNN autotune"""
+        dummy = np.zeros((1, *self.target_size, 3), dtype=np.float32)
+        self._forward(dummy)
+
+    def preprocess(self, face_img, enforce_detection=False):
+        """
+        Turn a BGR face crop into a (1, H, W, 3) model input.
+
+        Raises:
+            ValueError: if enforce_detection is set and no face is found
+        """
+        img_objs = functions.extract_faces(
+            img=face_img,
+            target_size=self.target_size,
+            detector_backend=self.detector_backend,
+            grayscale=False,
+            enforce_detection=enforce_detection,
+            align=True
+        )
+        return img_objs[0][0]
+
+    def _forward(self, batch):
+        """
+        One inference call. Calling the traced graph directly skips
+        model.predict's per-call dataset/callback setup (which dominates for a
+        handful of faces) and eager mode's per-layer Python dispatch.
+        """
+        if self.session is not None:
+            return np.asarray(self.session.run(None, {self._onnx_input: batch})[0], dtype=np.float32)
+        return np.asarray(self._graph(batch), dtype=np.float32)
+
+    def embed_batch(self, face_tensors):
+        """Run one forward pass over preprocessed inputs; returns (K, D) float32"""
+        if len(face_tensors) == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        if len(face_tensors) > self.MAX_BATCH:
+            batch = np.concatenate(face_tensors, axis=0)
+            return self._forward(batch)
+
+        with self._batch_lock:
+            batch = self._batch_buf[:len(face_tensors)]
+            for i, tensor in enumerate(face_tensors):
+                batch[i] = tensor[0]
+            return self._forward(batch)
+
+    def represent(self, face_img):
+        """Embedding of a single face crop (same result as DeepFace.represent)"""
+        return self.embed_batch([self.preprocess(face_img)])[0]
+
+
+def export_onnx(model_name, onnx_path):
+    """One-time export of a DeepFace model to ONNX (requires tf2onnx)"""
+    import tf2onnx
+
+    model = DeepFace.build_model(model_name)
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=onnx_path)
+    print(f"✓ Exported {model_name} to {onnx_path}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    export_onnx("Facenet", sys.argv[1] if len(sys.argv) > 1 else "facenet.onnx")
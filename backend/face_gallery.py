@@ -0,0 +1,763 @@
+"""
+Face Gallery
+Known-face embeddings stored as one contiguous float32 matrix so that
+recognition is a single vectorized distance pass instead of a Python loop.
+
+On disk a gallery is an ``.npz`` snapshot (``names`` plus the float32
+``emb`` matrix, read back in one piece) and an append-only journal of
+changes made since that snapshot, so registering a face writes one small
+record instead of rewriting the whole database (or, with
+``journal_interval``, one batch of records every few seconds from a
+background thread). Older pickled
+``{name: embedding}`` snapshots are still read. Large galleries also keep
+their faiss HNSW index next to the snapshot so it isn't rebuilt on every start.
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    faiss = None
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+    hnswlib = None
+
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    SIMSIMD_AVAILABLE = False
+    simsimd = None
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    njit = None
+    prange = range
+
+
+def _nearest_loops(queries, matrix):
+    """
+    Row index and squared L2 distance of the closest row for each query,
+    summed from the differences directly (no |m|^2 - 2 m.q + |q|^2
+    cancellation) and reduced as it goes, so no (K, N) distance matrix is
+    materialized. Written as plain loops for numba to compile (parallel over
+    queries, fastmath lets LLVM use FMA).
+    """
+    best_rows = np.zeros(queries.shape[0], dtype=np.int64)
+    best_sq = np.full(queries.shape[0], np.inf, dtype=np.float32)
+    for k in prange(queries.shape[0]):
+        for i in range(matrix.shape[0]):
+            total = np.float32(0.0)
+            for j in range(matrix.shape[1]):
+                d = matrix[i, j] - queries[k, j]
+                total += d * d
+            if total < best_sq[k]:
+                best_sq[k] = total
+                best_rows[k] = i
+    return best_rows, best_sq
+
+
+# fastmath minus 'nnan' / 'ninf': the running minimum starts at inf, which
+# full fastmath would let LLVM assume never occurs
+_FASTMATH = {'contract', 'reassoc', 'nsz', 'arcp'}
+
+if NUMBA_AVAILABLE:
+    _nearest_jit = njit(parallel=True, fastmath=_FASTMATH, cache=True)(_nearest_loops)
+
+# Embedding sizes of the DeepFace models we use (Facenet, Facenet512)
+SPECIALIZED_DIMS = (128, 512)
+_nearest_kernels = {}  # dim -> compiled kernel with that dim baked in
+
+
+def _make_nearest(dim):
+    """
+    _nearest_loops with the embedding length fixed at `dim`. numba freezes
+    closure variables as compile-time constants, so LLVM sees a constant
+    trip count and can fully unroll and vectorize the inner loop.
+    """
+    def nearest_fixed(queries, matrix):
+        best_rows = np.zeros(queries.shape[0], dtype=np.int64)
+        best_sq = np.full(queries.shape[0], np.inf, dtype=np.float32)
+        for k in prange(queries.shape[0]):
+            for i in range(matrix.shape[0]):
+                total = np.float32(0.0)
+                for j in range(dim):
+                    d = matrix[i, j] - queries[k, j]
+                    total += d * d
+                if total < best_sq[k]:
+                    best_sq[k] = total
+                    best_rows[k] = i
+        return best_rows, best_sq
+
+    # Closures can't go in numba's on-disk cache; compiled once per process
+    return njit(parallel=True, fastmath=_FASTMATH, boundscheck=False)(nearest_fixed)
+
+
+def _nearest_kernel(dim):
+    """Specialized kernel for the common embedding sizes, generic one otherwise"""
+    if dim not in SPECIALIZED_DIMS:
+        return _nearest_jit
+    if dim not in _nearest_kernels:
+        _nearest_kernels[dim] = _make_nearest(dim)
+    return _nearest_kernels[dim]
+
+
+def _append_row(buf, count, row):
+    """
+    Write `row` at index `count` of `buf` (2-D, or 1-D for per-row scalars),
+    doubling its capacity when full, so adding a face costs O(D) amortized
+    instead of an O(N*D) vstack. Returns the (possibly reallocated) buffer.
+    """
+    if count == len(buf):
+        grown = np.empty((max(16, 2 * count), *buf.shape[1:]), dtype=np.float32)
+        grown[:count] = buf[:count]
+        buf = grown
+    buf[count] = row
+    return buf
+
+
+class FaceGallery(Mapping):
+    """
+    Read-only ``name -> embedding`` mapping backed by an (N, D) float32 matrix.
+
+    ``names[i]`` is the owner of ``matrix[i]``. Mutate only through
+    add / rename / remove so the two never drift apart.
+
+    When faiss is installed, search goes through a faiss index whose ids are
+    the matrix row numbers: exact IndexFlatL2 for small galleries, HNSW
+    once the gallery reaches HNSW_MIN_SIZE faces. Without faiss, hnswlib
+    provides the HNSW index for large galleries instead.
+
+    With ``quantize=True`` the search runs over int8 codes (4x less memory
+    traffic per scan). ``matrix`` itself always stays float32 so nothing is
+    lost on disk.
+
+    ``metric="euclidean_l2"`` compares unit-normalized embeddings (DeepFace's
+    name for it). Scoring is then one inner product per face, and the
+    distance returned is sqrt(2 - 2*cos). ``matrix`` keeps the raw
+    embeddings; the normalized copy only lives in memory.
+
+    ``journal_interval`` (seconds) defers journal writes: records collect in
+    memory and a daemon thread appends them with one fsync per interval, so
+    callers on a real-time loop never wait on the disk. Changes made in the
+    last interval are lost if the process dies; call flush() or save()
+    before a clean exit. Either way, folding a long journal back into the
+    snapshot happens on that background thread, never on the caller's.
+    """
+
+    METRICS = ('euclidean', 'euclidean_l2')
+
+    HNSW_MIN_SIZE = 1000
+    HNSW_NEIGHBORS = 32
+    # Beam widths for building / searching either HNSW backend; faiss's own
+    # defaults (40 / 16) miss the true nearest face noticeably often
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_SEARCH = 64
+    COMPACT_EVERY = 100  # Journal records before folding them into the snapshot
+
+    def __init__(self, dim=128, quantize=False, path=None, metric='euclidean', journal_interval=None):
+        if metric not in self.METRICS:
+            raise ValueError(f"Unsupported metric {metric!r}, expected one of {self.METRICS}")
+        self.dim = dim
+        self.quantize = quantize
+        self.metric = metric
+        self.path = path  # Snapshot file; None keeps the gallery in memory only
+        self._lock = threading.RLock()  # In-memory state (mutations and searches)
+        # Serializes writers end to end, so journal order matches mutation
+        # order while searches only wait for the in-memory update, not fsync
+        self._journal_lock = threading.RLock()
+        self._journal_records = 0
+        self.journal_interval = journal_interval
+        self._pending = []  # Journal records not yet written (journal_interval only)
+        self._flusher = None
+        self._flush_lock = threading.Lock()  # Serializes journal file writes; taken before _journal_lock
+        self._compact_due = threading.Event()  # Wakes the flusher to fold the journal into the snapshot
+        self.next_id = 0  # Counter for callers that auto-number faces; saved with the snapshot
+        self._snapshot_next_id = None  # next_id as of the snapshot on disk
+        self.names = []
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self._buf = self.matrix  # Backing store with spare rows; matrix is its first N rows
+        self._rows = {}  # name -> row index into self.matrix
+        self._unit = None  # Row-normalized matrix for euclidean_l2; None means "rebuild"
+        self._unit_buf = None
+        self._faiss_index = None  # Built lazily; None means "rebuild"
+        self._hnsw_index = None  # hnswlib fallback, same lifecycle as the faiss index
+        self._codes = None  # int8 copy of matrix when quantizing; None means "rebuild"
+        self._code_scale = 1.0
+        self._code_sqnorms = None  # |c|^2 per code row, built with the codes
+        self._code_floats = None  # float32 copy of the codes for the BLAS fallback (no simsimd)
+        self._sqnorms = None  # |m|^2 per matrix row for brute-force euclidean; None means "rebuild"
+        self._sqnorms_buf = None
+
+    # ------------------------------------------------------------------
+    # Mapping interface (keeps `len(...)`, `in`, `.keys()` call sites working)
+    # ------------------------------------------------------------------
+    def __getitem__(self, name):
+        return self.matrix[self._rows[name]]
+
+    def __iter__(self):
+        return iter(list(self.names))  # Snapshot - other threads may register meanwhile
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    # ------------------------------------------------------------------
+    # Mutation
+    # ------------------------------------------------------------------
+    def add(self, name, embedding):
+        """Append a new embedding (or overwrite an existing name's row)."""
+        emb = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self._journal_lock:
+            with self._lock:
+                self._add(name, emb)
+            self._append_journal(('add', name, emb))
+
+    def rename(self, old_name, new_name):
+        """Rename in place - the embedding row does not move."""
+        with self._journal_lock:
+            with self._lock:
+                self._rename(old_name, new_name)
+            self._append_journal(('rename', old_name, new_name))
+
+    def remove(self, name):
+        """Drop a name and its row, re-indexing the rows after it."""
+        with self._journal_lock:
+            with self._lock:
+                self._remove(name)
+            self._append_journal(('remove', name))
+
+    def _add(self, name, emb):
+        if len(self.names) == 0:
+            self.dim = emb.shape[0]
+            self.matrix = self._buf = np.empty((0, self.dim), dtype=np.float32)
+
+        if name in self._rows:
+            self.matrix[self._rows[name]] = emb
+            self._invalidate()
+            return
+
+        self._rows[name] = len(self.names)
+        self.names.append(name)
+        self._buf = _append_row(self._buf, len(self.names) - 1, emb)
+        self.matrix = self._buf[:len(self.names)]
+
+        if self.quantize:
+            # The int8 scale (and faiss's SQ8 ranges) depend on every row
+            self._invalidate()
+            return
+
+        row = self._normalize(emb)[None, :]
+        if self._sqnorms is not None:
+            self._sqnorms_buf = _append_row(self._sqnorms_buf, len(self.names) - 1, emb @ emb)
+            self._sqnorms = self._sqnorms_buf[:len(self.names)]
+        if self._unit is not None:
+            self._unit_buf = _append_row(self._unit_buf, len(self.names) - 1, row[0])
+            self._unit = self._unit_buf[:len(self.names)]
+        if self._faiss_index is not None:
+            # Append to the live index unless it is time to switch to HNSW
+            if len(self.names) == self.HNSW_MIN_SIZE:
+                self._faiss_index = None
+            else:
+                self._faiss_index.add(row)
+        if self._hnsw_index is not None:
+            if len(self.names) > self._hnsw_index.get_max_elements():
+                self._hnsw_index.resize_index(2 * len(self.names))
+            self._hnsw_index.add_items(row, np.array([len(self.names) - 1]))
+
+    def _rename(self, old_name, new_name):
+        row = self._rows.pop(old_name)
+        self._rows[new_name] = row
+        self.names[row] = new_name
+
+    def _remove(self, name):
+        row = self._rows.pop(name)
+        del self.names[row]
+        self.matrix = self._buf = np.delete(self.matrix, row, axis=0)
+        self._rows = {n: i for i, n in enumerate(self.names)}
+        self._invalidate()  # Row ids shifted
+
+    def _invalidate(self):
+        """Drop derived search structures; they are rebuilt on next search"""
+        self._faiss_index = None
+        self._hnsw_index = None
+        self._codes = None
+        self._code_sqnorms = None
+        self._code_floats = None
+        self._sqnorms = self._sqnorms_buf = None
+        self._unit = self._unit_buf = None
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _normalize(self, emb):
+        """Unit-normalize a vector for euclidean_l2; identity for euclidean"""
+        if self.metric == 'euclidean':
+            return emb
+        return emb / max(float(np.linalg.norm(emb)), 1e-12)
+
+    def _search_matrix(self):
+        """The rows search actually runs over (raw or unit-normalized)"""
+        if self.metric == 'euclidean':
+            return self.matrix
+        if self._unit is None:
+            norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+            self._unit = self._unit_buf = np.ascontiguousarray(
+                self.matrix / np.maximum(norms, 1e-12), dtype=np.float32
+            )
+        return self._unit
+
+    def _get_faiss_index(self):
+        """Return the faiss index, rebuilding it from the matrix if stale"""
+        if self._faiss_index is None:
+            data = np.ascontiguousarray(self._search_matrix())
+            hnsw = len(self.names) >= self.HNSW_MIN_SIZE
+            inner_product = self.metric == 'euclidean_l2'
+            faiss_metric = faiss.METRIC_INNER_PRODUCT if inner_product else faiss.METRIC_L2
+
+            if self.quantize:
+                qtype = faiss.ScalarQuantizer.QT_8bit
+                if hnsw:
+                    index = faiss.IndexHNSWSQ(self.dim, qtype, self.HNSW_NEIGHBORS, faiss_metric)
+                    index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+                else:
+                    index = faiss.IndexScalarQuantizer(self.dim, qtype, faiss_metric)
+                index.train(data)
+            elif hnsw:
+                index = faiss.IndexHNSWFlat(self.dim, self.HNSW_NEIGHBORS, faiss_metric)
+                index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+            elif inner_product:
+                index = faiss.IndexFlatIP(self.dim)
+            else:
+                index = faiss.IndexFlatL2(self.dim)
+
+            index.add(data)
+            if hnsw:
+                index.hnsw.efSearch = self.HNSW_EF_SEARCH
+            self._faiss_index = index
+        return self._faiss_index
+
+    def _get_hnsw_index(self):
+        """Return the hnswlib index (labels are row numbers), rebuilding it if stale"""
+        if self._hnsw_index is None:
+            data = np.ascontiguousarray(self._search_matrix())
+            space = 'ip' if self.metric == 'euclidean_l2' else 'l2'
+            index = hnswlib.Index(space=space, dim=self.dim)
+            index.init_index(max_elements=2 * len(self.names), ef_construction=self.HNSW_EF_CONSTRUCTION,
+                             M=self.HNSW_NEIGHBORS)
+            index.add_items(data, np.arange(len(self.names)))
+            index.set_ef(self.HNSW_EF_SEARCH)
+            self._hnsw_index = index
+        return self._hnsw_index
+
+    def _get_codes(self):
+        """
+        Return the int8 codes of the matrix, rebuilding them if stale.
+
+        One symmetric scale is shared by every row so that the L2 distance
+        between two codes is the float distance divided by that scale -
+        codes can then be compared directly by an int8 SIMD kernel.
+        """
+        if self._codes is None:
+            rows = self._search_matrix()
+            peak = float(np.abs(rows).max()) if len(self.names) else 0.0
+            self._code_scale = max(peak, 1e-12) / 127.0
+            self._codes = np.round(rows / self._code_scale).astype(np.int8)
+            c = self._codes.astype(np.float32)  # Exact: small integers
+            self._code_sqnorms = np.einsum('ij,ij->i', c, c)
+            # Kept for the GEMM fallback so searches don't re-convert N x D codes
+            self._code_floats = None if SIMSIMD_AVAILABLE else c
+        return self._codes
+
+    def _get_sqnorms(self):
+        """Return |m|^2 for every matrix row, computed once instead of per query"""
+        if self._sqnorms is None:
+            self._sqnorms = self._sqnorms_buf = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        return self._sqnorms
+
+    def _quantized_sq_dists(self, queries):
+        """Approximate squared L2 distances (K, N) to every row using the int8 codes"""
+        codes = self._get_codes()
+        scale = self._code_scale
+        query_codes = np.clip(np.round(queries / scale), -127, 127).astype(np.int8)
+
+        if SIMSIMD_AVAILABLE:
+            sq_codes = np.asarray(simsimd.cdist(query_codes, codes, metric='sqeuclidean'))
+        else:
+            # |c - q|^2 = |c|^2 - 2 c.q + |q|^2. NumPy's integer matmul has no
+            # BLAS kernel, but int8 dot products stay below 2^24 for D <= 1024,
+            # so a float32 GEMM over the codes is still exact
+            q = query_codes.astype(np.float32)
+            sq_codes = (
+                self._code_sqnorms[None, :]
+                - 2.0 * (q @ self._code_floats.T)
+                + np.einsum('ij,ij->i', q, q)[:, None]
+            )
+
+        return sq_codes.astype(np.float32) * (scale * scale)
+
+    def _sq_dists(self, queries):
+        """Squared L2 distances (K, N) from `queries` (already normalized) to every row (brute force)"""
+        if self.quantize:
+            return self._quantized_sq_dists(queries)
+
+        if self.metric == 'euclidean_l2':
+            # Unit vectors: |u - q|^2 = 2 - 2 u.q, so one BLAS GEMM does it
+            return 2.0 - 2.0 * (queries @ self._search_matrix().T)
+
+        if SIMSIMD_AVAILABLE:
+            # One batched SIMD kernel call (AVX2/AVX-512/NEON/SVE dispatch)
+            return np.asarray(simsimd.cdist(queries, self.matrix, metric='sqeuclidean'))
+
+        # |m - q|^2 = |m|^2 - 2 m.q + |q|^2 - the cross term is one GEMM
+        # (GEMV for a single face), the row norms are cached
+        return (
+            self._get_sqnorms()[None, :]
+            - 2.0 * (queries @ self.matrix.T)
+            + np.einsum('ij,ij->i', queries, queries)[:, None]
+        )
+
+    def _uses_numba(self):
+        """Whether nearest_batch will search with the numba kernel (no index, no int8 codes)"""
+        if not NUMBA_AVAILABLE or FAISS_AVAILABLE or self.quantize or SIMSIMD_AVAILABLE:
+            return False
+        return not (HNSWLIB_AVAILABLE and len(self.names) >= self.HNSW_MIN_SIZE)
+
+    def warmup(self):
+        """Compile the numba search kernel now, so the first real search doesn't pay for it"""
+        if self._uses_numba():
+            dummy = np.zeros((1, self.dim), dtype=np.float32)
+            _nearest_kernel(self.dim)(dummy, dummy)
+
+    def nearest(self, embedding):
+        """
+        Find the closest known face by Euclidean distance (between
+        unit-normalized embeddings for the euclidean_l2 metric).
+
+        Returns:
+            (name, distance) or (None, inf) if the gallery is empty
+        """
+        return self.nearest_batch([embedding])[0]
+
+    def nearest_batch(self, embeddings):
+        """
+        nearest() for K embeddings at once - one index search / GEMM for
+        every face in a frame instead of K.
+
+        Returns:
+            list of (name, distance), parallel to `embeddings`
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = queries.reshape(len(queries), -1)
+        if self.metric == 'euclidean_l2':
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.maximum(norms, 1e-12)
+        queries = np.ascontiguousarray(queries)
+
+        with self._lock:
+            if len(self.names) == 0 or len(queries) == 0:
+                return [(None, float('inf'))] * len(queries)
+
+            if FAISS_AVAILABLE:
+                scores, ids = self._get_faiss_index().search(queries, 1)
+                if (ids[:, 0] >= 0).all():
+                    sq_dists = scores[:, 0].astype(np.float64)
+                    if self.metric == 'euclidean_l2':
+                        sq_dists = 2.0 - 2.0 * sq_dists  # Index returns cosine similarity
+                    return [
+                        (self.names[int(idx)], float(np.sqrt(max(sq, 0.0))))
+                        for idx, sq in zip(ids[:, 0], sq_dists)
+                    ]
+
+            elif HNSWLIB_AVAILABLE and not self.quantize and len(self.names) >= self.HNSW_MIN_SIZE:
+                labels, dists = self._get_hnsw_index().knn_query(queries, k=1)
+                sq_dists = dists[:, 0].astype(np.float64)
+                if self.metric == 'euclidean_l2':
+                    sq_dists = 2.0 * sq_dists  # 'ip' space returns 1 - cos
+                return [
+                    (self.names[int(idx)], float(np.sqrt(max(sq, 0.0))))
+                    for idx, sq in zip(labels[:, 0], sq_dists)
+                ]
+
+            if self._uses_numba():
+                # Fused distance + argmin (over the unit rows for euclidean_l2,
+                # where queries are already normalized); sqrt only for the winners
+                kernel = _nearest_kernel(self.matrix.shape[1])
+                rows, best_sq = kernel(queries, np.ascontiguousarray(self._search_matrix()))
+                return [
+                    (self.names[int(idx)], float(np.sqrt(max(float(sq), 0.0))))
+                    for idx, sq in zip(rows, best_sq)
+                ]
+
+            sq_dists = self._sq_dists(queries)
+
+            # sqrt is monotonic, so only the winners need it
+            best = np.argmin(sq_dists, axis=1)
+            return [
+                (self.names[int(idx)], float(np.sqrt(max(float(sq_dists[k, idx]), 0.0))))
+                for k, idx in enumerate(best)
+            ]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_arrays(cls, names, matrix, **kwargs):
+        """Build from a name list and its parallel (N, D) embedding matrix"""
+        gallery = cls(**kwargs)
+        if len(names):
+            gallery.names = [str(n) for n in names]
+            gallery.matrix = gallery._buf = np.ascontiguousarray(matrix, dtype=np.float32)
+            gallery.dim = gallery.matrix.shape[1]
+            gallery._rows = {n: i for i, n in enumerate(gallery.names)}
+        return gallery
+
+    @classmethod
+    def from_dict(cls, faces, **kwargs):
+        names = list(faces.keys()) if faces else []
+        if not names:
+            return cls(**kwargs)
+        matrix = np.stack([np.asarray(faces[n], dtype=np.float32).reshape(-1) for n in names])
+        return cls.from_arrays(names, matrix, **kwargs)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: self.matrix[i].tolist() for i, name in enumerate(self.names)}
+
+    @property
+    def journal_path(self):
+        return self.path + '.journal'
+
+    @property
+    def index_path(self):
+        """faiss index saved with the snapshot; the name encodes how it was built"""
+        kind = self.metric + ('-sq8' if self.quantize else '')
+        return f"{self.path}.{kind}.faiss"
+
+    def _load_index(self):
+        """
+        Adopt the saved faiss index if it was written after the snapshot and
+        covers exactly its rows; otherwise it is rebuilt on first search.
+        """
+        if not FAISS_AVAILABLE or len(self.names) < self.HNSW_MIN_SIZE:
+            return
+        try:
+            if os.path.getmtime(self.index_path) < os.path.getmtime(self.path):
+                return
+            index = faiss.read_index(self.index_path)
+        except (OSError, RuntimeError):
+            return
+        if index.ntotal == len(self.names) and index.d == self.dim:
+            index.hnsw.efSearch = self.HNSW_EF_SEARCH  # Search-time setting, not trusted from the file
+            self._faiss_index = index
+
+    def _save_index(self):
+        """Write the (HNSW-sized) faiss index next to the snapshot just saved"""
+        if not FAISS_AVAILABLE or len(self.names) < self.HNSW_MIN_SIZE:
+            return
+        with self._lock:
+            index = self._get_faiss_index()
+            tmp_path = self.index_path + '.tmp'
+            faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Load the snapshot at `path` and replay its journal.
+        Missing files give an empty gallery; later changes are saved to `path`.
+
+        A missing ``.npz`` snapshot is imported once from the ``.pkl`` file
+        of the same name, which is left untouched as a backup.
+        """
+        source = path
+        root, ext = os.path.splitext(path)
+        if not os.path.exists(path) and ext == '.npz' and os.path.exists(root + '.pkl'):
+            source = root + '.pkl'
+
+        gallery = None
+        legacy = False
+        if os.path.exists(source):
+            with open(source, 'rb') as f:
+                if f.read(4) == b'PK\x03\x04':  # npz (zip) snapshot
+                    f.seek(0)
+                    with np.load(f) as data:
+                        gallery = cls.from_arrays(data['names'], data['emb'], **kwargs)
+                        if 'next_id' in data:
+                            gallery.next_id = int(data['next_id'])
+                else:  # Legacy pickled dict
+                    f.seek(0)
+                    gallery = cls.from_dict(pickle.load(f), **kwargs)
+                    legacy = True
+
+        if gallery is None:
+            gallery = cls(**kwargs)
+        gallery.path = source
+        gallery._snapshot_next_id = gallery.next_id
+        if source == path:
+            gallery._load_index()
+        gallery._replay_journal()
+
+        if legacy or source != path:
+            # Write the npz snapshot once so later starts skip unpickling every
+            # embedding; a pickle being replaced in place is kept as .bak
+            if source == path:
+                os.replace(path, path + '.bak')
+            gallery.path = path
+            gallery._snapshot_next_id = None
+            gallery.save()
+            print(f"✓ Converted {source} to npz snapshot {path}")
+        return gallery
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r+b') as f:
+            while True:
+                good_offset = f.tell()
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError):
+                    # Torn final record from a crash mid-write - cut it off so
+                    # later appends stay readable
+                    print(f"⚠️  Dropping truncated record at end of {self.journal_path}")
+                    f.truncate(good_offset)
+                    break
+
+                op = record[0]
+                if op == 'add':
+                    self._add(record[1], np.asarray(record[2], dtype=np.float32))
+                elif op == 'rename' and record[1] in self._rows and record[2] not in self._rows:
+                    self._rename(record[1], record[2])
+                elif op == 'remove' and record[1] in self._rows:
+                    self._remove(record[1])
+                self._journal_records += 1
+
+    def _append_journal(self, record):
+        """Durably append one change record; compact once the journal is long"""
+        if self.path is None:
+            return
+
+        if self.journal_interval:
+            self._pending.append(record)
+            self._start_flusher()
+        else:
+            self._write_journal([record])
+        self._journal_records += 1
+
+        if self._journal_records >= self.COMPACT_EVERY:
+            self._compact_due.set()
+            self._start_flusher()
+
+    def _write_journal(self, records):
+        with open(self.journal_path, 'ab') as f:
+            for record in records:
+                pickle.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            # Without journal_interval this only wakes up to compact
+            if self._compact_due.wait(self.journal_interval):
+                self._compact_due.clear()
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"⚠️  Gallery compaction failed: {e}")
+            else:
+                self.flush()
+
+    def flush(self):
+        """Write journal records deferred by journal_interval"""
+        with self._flush_lock:
+            with self._journal_lock:
+                records, self._pending = self._pending, []
+            if records:
+                self._write_journal(records)
+
+    def _trim_journal(self, offset):
+        """Drop the first `offset` bytes of the journal (records now in the snapshot)"""
+        if not os.path.exists(self.journal_path):
+            return
+        if os.path.getsize(self.journal_path) <= offset:
+            os.remove(self.journal_path)
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def save(self, path=None):
+        """
+        Write a full snapshot atomically (temp file + os.replace) and clear
+        the journal it supersedes. Skipped when the snapshot on disk is
+        already current.
+
+        Writers are only held off while the rows are copied; changes made
+        during the write stay in the journal for the next snapshot.
+        """
+        with self._flush_lock:
+            with self._journal_lock:
+                if path is not None and path != self.path:
+                    self.path = path
+                    self._snapshot_next_id = None  # Force a write to the new location
+                if self.path is None:
+                    return
+                if (self._journal_records == 0 and self.next_id == self._snapshot_next_id
+                        and os.path.exists(self.path)):
+                    return
+
+                path = self.path
+                names = np.array(self.names, dtype=str)
+                emb = self.matrix.copy()
+                next_id = self.next_id
+                compacted = self._journal_records
+                self._pending = []  # Already in the snapshot
+                journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                # File object, so numpy doesn't append ".npz" to the name
+                np.savez(f, names=names, emb=emb, next_id=np.int64(next_id))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._save_index()
+
+            with self._journal_lock:
+                self._trim_journal(journal_size)
+                self._journal_records -= compacted
+                self._snapshot_next_id = next_id
@@ -0,0 +1,163 @@
+"""
+Face Tracking
+Minimal IoU tracker that gives each detected face a stable id across frames,
+so recognition only has to run when a new face appears.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    njit = None
+
+
+def _iou_matrix_numpy(a, b):
+    """Broadcasting version of iou_matrix, used when numba is missing"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    inter_h = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    inter = inter_w * inter_h
+
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _iou_matrix_loops(a, b):
+    """Same as _iou_matrix_numpy, written as plain loops for numba to compile"""
+    out = np.empty((a.shape[0], b.shape[0]), dtype=np.float32)
+    for i in range(a.shape[0]):
+        ax1, ay1 = a[i, 0], a[i, 1]
+        ax2, ay2 = ax1 + a[i, 2], ay1 + a[i, 3]
+        area_a = a[i, 2] * a[i, 3]
+        for j in range(b.shape[0]):
+            bx1, by1 = b[j, 0], b[j, 1]
+            bx2, by2 = bx1 + b[j, 2], by1 + b[j, 3]
+            inter_w = max(min(ax2, bx2) - max(ax1, bx1), 0.0)
+            inter_h = max(min(ay2, by2) - max(ay1, by1), 0.0)
+            inter = inter_w * inter_h
+            union = area_a + b[j, 2] * b[j, 3] - inter
+            out[i, j] = inter / max(union, 1e-6)
+    return out
+
+
+if NUMBA_AVAILABLE:
+    _iou_matrix_jit = njit(cache=True)(_iou_matrix_loops)
+
+
+def iou_matrix(a, b):
+    """
+    Pairwise intersection-over-union of two sets of (x, y, w, h) boxes.
+
+    Uses a numba-compiled loop when numba is installed, NumPy broadcasting
+    otherwise.
+
+    Args:
+        a: (K, 4) array of boxes
+        b: (M, 4) array of boxes
+
+    Returns:
+        (K, M) float32 array of IoU values
+    """
+    if NUMBA_AVAILABLE:
+        a = np.ascontiguousarray(a, dtype=np.float32).reshape(-1, 4)
+        b = np.ascontiguousarray(b, dtype=np.float32).reshape(-1, 4)
+        return _iou_matrix_jit(a, b)
+    return _iou_matrix_numpy(a, b)
+
+
+def shift_boxes_by_flow(prev_gray, gray, boxes, grid=4, min_points=3):
+    """
+    Move (x, y, w, h) boxes from `prev_gray` to `gray` with pyramidal
+    Lucas-Kanade optical flow, so frames between detections need no
+    detector pass.
+
+    Each box is tracked by a grid x grid lattice of points over its inner
+    area (corners are mostly background); the box moves by the median
+    displacement of its points. Boxes with fewer than `min_points` tracked
+    points are dropped.
+    """
+    if len(boxes) == 0:
+        return []
+
+    # Lattice over the middle 60% of each box, all boxes in one LK call
+    steps = (np.arange(grid, dtype=np.float32) + 0.5) / grid * 0.6 + 0.2
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    xs = boxes[:, 0:1, None] + boxes[:, 2:3, None] * steps[None, None, :]
+    ys = boxes[:, 1:2, None] + boxes[:, 3:4, None] * steps[None, :, None]
+    points = np.stack(np.broadcast_arrays(xs, ys), axis=-1).reshape(-1, 1, 2)
+
+    new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None)
+    motion = (new_points - points).reshape(len(boxes), grid * grid, 2)
+    ok = status.reshape(len(boxes), grid * grid).astype(bool)
+
+    shifted = []
+    for box, box_motion, box_ok in zip(boxes, motion, ok):
+        if box_ok.sum() < min_points:
+            continue
+        dx, dy = np.median(box_motion[box_ok], axis=0)
+        shifted.append((float(box[0] + dx), float(box[1] + dy), float(box[2]), float(box[3])))
+    return shifted
+
+
+class FaceTracker:
+    """
+    Greedy IoU tracker.
+
+    Each call to update() matches the new detections against live tracks
+    (highest IoU first). Unmatched detections start new tracks; tracks that
+    go unmatched for longer than ``max_age`` seconds are dropped.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = {}  # track_id -> {'bbox': (x, y, w, h), 'last_seen': float}
+        self._next_id = 0
+
+    def update(self, boxes):
+        """
+        Assign a track id to each box.
+
+        Returns:
+            list of track ids, parallel to `boxes`
+        """
+        now = time.monotonic()
+        track_ids = list(self.tracks.keys())
+        assigned = [None] * len(boxes)
+
+        if track_ids and len(boxes) > 0:
+            ious = iou_matrix(boxes, [self.tracks[t]['bbox'] for t in track_ids])
+
+            # Greedy: repeatedly take the best remaining (detection, track) pair
+            while True:
+                det, trk = np.unravel_index(int(np.argmax(ious)), ious.shape)
+                if ious[det, trk] < self.iou_threshold:
+                    break
+                assigned[det] = track_ids[trk]
+                ious[det, :] = -1
+                ious[:, trk] = -1
+
+        for det, box in enumerate(boxes):
+            if assigned[det] is None:
+                assigned[det] = self._next_id
+                self._next_id += 1
+            self.tracks[assigned[det]] = {'bbox': tuple(int(v) for v in box), 'last_seen': now}
+
+        # Forget tracks that have not been seen for a while
+        for track_id in [t for t, trk in self.tracks.items() if now - trk['last_seen'] > self.max_age]:
+            del self.tracks[track_id]
+
+        return assigned
@@ -3,15 +3,22 @@ Headless Facial Sentiment Analysis Module
 Captures facial emotions in background without GUI for integration with sales call analyzer.
 """
 
-import cv2
 import threading
 import time
-from collections import deque, Counter
 from datetime import datetime
 import numpy as np
+from frame_grabber import FrameGrabber
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    njit = None
 
 try:
     from fer.fer import FER
+    from emotion_model import preprocess_faces
     FER_AVAILABLE = True
 except ImportError as e:
     FER_AVAILABLE = False
@@ -19,13 +26,38 @@ except ImportError as e:
     # Silent import - error will be shown in sales_call_analyzer.py
 
 
+def _positivity_diff_loops(labels, polarity):
+    """
+    Mean polarity of the second half of `labels` minus that of the first
+    half, in one pass - plain loops for numba to compile
+    """
+    mid = labels.shape[0] // 2
+    first = 0.0
+    second = 0.0
+    for i in range(labels.shape[0]):
+        if i < mid:
+            first += polarity[labels[i]]
+        else:
+            second += polarity[labels[i]]
+    return second / (labels.shape[0] - mid) - first / mid
+
+
+if NUMBA_AVAILABLE:
+    _positivity_diff_jit = njit(cache=True)(_positivity_diff_loops)
+
+
 class HeadlessFacialSentiment:
     """
     Background facial emotion capture without GUI.
     Continuously captures emotions and aggregates them over time windows.
     """
     
-    def __init__(self, camera_index=0, use_mtcnn=False, sample_interval=1.0):
+    # FER's label order; rows of the score buffer follow it
+    EMOTIONS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+    # +1 positive, -1 negative, 0 neutral - per label, for the trajectory
+    POLARITY = np.array([-1, -1, -1, 1, -1, 1, 0], dtype=np.float32)
+    
+    def __init__(self, camera_index=0, use_mtcnn=False, sample_interval=1.0, batch_size=1):
         """
         Initialize headless facial sentiment analyzer.
         
@@ -33,6 +65,8 @@ class HeadlessFacialSentiment:
             camera_index: Camera device index (default: 0)
             use_mtcnn: Use MTCNN detector for accuracy vs OpenCV for speed
             sample_interval: Seconds between emotion samples (default: 1.0)
+            batch_size: Frames whose faces go through the emotion CNN in one
+                        call (worth raising with a short sample_interval)
         """
         if not FER_AVAILABLE or FER is None:
             raise ImportError("FER library not found in current Python environment")
@@ -40,20 +74,28 @@ class HeadlessFacialSentiment:
         self.camera_index = camera_index
         self.use_mtcnn = use_mtcnn
         self.sample_interval = sample_interval
+        self.batch_size = batch_size
+        self.max_batch_delay = 1.0  # Seconds a queued face may wait for the batch to fill
+        self._pending = []  # (timestamp, classifier input) waiting for a batched forward pass
         
         # Initialize FER detector
         print(f"🎥 Initializing facial emotion detector...")
         self.detector = FER(mtcnn=use_mtcnn)
         
-        # Camera and capture state
-        self.cap = None
+        # Camera and capture state (camera read on its own thread, newest frame only)
+        self.grabber = None
         self.running = False
         self.capture_thread = None
         self.latest_frame = None  # Latest frame for sharing with face detection
 
-        # Store emotion samples with timestamps
-        # Each sample: {'timestamp': datetime, 'emotion': str, 'confidence': float, 'all_emotions': dict}
-        self.emotion_samples = deque(maxlen=60)  # Keep last 60 samples (60 seconds at 1/sec)
+        # Ring buffer of the last `capacity` samples (60 seconds at 1/sec) as
+        # parallel arrays, so summaries are vectorized instead of dict loops
+        self.capacity = 60
+        self._timestamps = np.zeros(self.capacity, dtype=np.float64)  # POSIX seconds
+        self._scores = np.zeros((self.capacity, len(self.EMOTIONS)), dtype=np.float32)
+        self._labels = np.zeros(self.capacity, dtype=np.int8)  # Dominant emotion index
+        self._head = 0  # Next slot to write
+        self._count = 0
 
         # Lock for thread-safe access to emotion samples
         self.lock = threading.Lock()
@@ -70,23 +112,21 @@ class HeadlessFacialSentiment:
         
         # Open camera
         print(f"📹 Opening camera {self.camera_index}...")
-        self.cap = cv2.VideoCapture(self.camera_index)
+        # Frames between samples are grabbed but not decoded
+        self.grabber = FrameGrabber(self.camera_index, min_interval=self.sample_interval / 2)
         
-        if not self.cap.isOpened():
-            self.last_error = f"Could not open camera {self.camera_index}"
+        if not self.grabber.start():
+            self.last_error = self.grabber.last_error
             print(f"❌ {self.last_error}")
             return False
         
-        # Test camera
+        # Test camera (let it warm up, then wait for a real frame)
         time.sleep(1.0)
-        for _ in range(5):
-            self.cap.read()
-        
-        ret, test_frame = self.cap.read()
-        if not ret or test_frame is None:
+        _, test_frame = self.grabber.read(timeout=2.0)
+        if test_frame is None:
             self.last_error = "Camera opened but cannot read frames (check permissions)"
             print(f"❌ {self.last_error}")
-            self.cap.release()
+            self.grabber.stop()
             return False
         
         print(f"✅ Camera started successfully")
@@ -102,17 +142,18 @@ class HeadlessFacialSentiment:
     
     def _capture_loop(self):
         """Background loop that captures emotions continuously."""
+        seq = None
         while self.running:
             try:
-                ret, frame = self.cap.read()
+                # Newest frame only - no stale frames queued in the camera buffer
+                seq, frame = self.grabber.read(seq, timeout=0.5)
 
-                if not ret or frame is None:
+                if frame is None:
                     self.consecutive_failures += 1
                     if self.consecutive_failures >= 10:
                         self.last_error = "Too many consecutive frame capture failures"
                         print(f"❌ {self.last_error}")
                         break
-                    time.sleep(0.1)
                     continue
 
                 # Reset failure counter
@@ -121,29 +162,15 @@ class HeadlessFacialSentiment:
                 # Store latest frame for sharing with face detection
                 self.latest_frame = frame.copy()
                 
-                # Detect emotions
-                emotions_data = self.detector.detect_emotions(frame)
-                
-                if emotions_data and len(emotions_data) > 0:
-                    # Get first face (assuming single customer)
-                    face_data = emotions_data[0]
-                    emotions = face_data['emotions']
-                    
-                    # Get dominant emotion
-                    dominant_emotion = max(emotions.items(), key=lambda x: x[1])
-                    emotion_name = dominant_emotion[0]
-                    confidence = dominant_emotion[1]
-                    
-                    # Store sample
-                    sample = {
-                        'timestamp': datetime.now(),
-                        'emotion': emotion_name,
-                        'confidence': confidence,
-                        'all_emotions': emotions.copy()
-                    }
+                if self.batch_size > 1:
+                    self._queue_face(frame)
+                else:
+                    # Detect emotions
+                    emotions_data = self.detector.detect_emotions(frame)
                     
-                    with self.lock:
-                        self.emotion_samples.append(sample)
+                    if emotions_data and len(emotions_data) > 0:
+                        # Get first face (assuming single customer)
+                        self._add_sample(datetime.now(), emotions_data[0]['emotions'])
                 
                 # Wait for next sample
                 time.sleep(self.sample_interval)
@@ -153,6 +180,77 @@ class HeadlessFacialSentiment:
                 print(f"⚠️  {self.last_error}")
                 time.sleep(1.0)
     
+    def _add_sample(self, timestamp, emotions):
+        """Store one face's emotion scores (FER's label -> score dict) as a sample."""
+        scores = np.array([[emotions.get(e, 0.0) for e in self.EMOTIONS]], dtype=np.float32)
+        self._add_samples(np.array([timestamp.timestamp()]), scores)
+    
+    def _add_samples(self, timestamps, scores):
+        """
+        Write K samples straight into the ring buffer.
+        
+        Args:
+            timestamps: (K,) POSIX seconds, oldest first
+            scores: (K, 7) emotion scores in EMOTIONS order
+        """
+        timestamps, scores = timestamps[-self.capacity:], scores[-self.capacity:]
+        
+        with self.lock:
+            slots = (self._head + np.arange(len(timestamps))) % self.capacity
+            self._timestamps[slots] = timestamps
+            self._scores[slots] = scores
+            self._labels[slots] = np.argmax(scores, axis=1)  # Dominant emotion
+            self._head = int(slots[-1] + 1) % self.capacity
+            self._count = min(self._count + len(slots), self.capacity)
+    
+    def _ordered_slots(self):
+        """Buffer indices of the stored samples, oldest first (call with the lock held)."""
+        return (self._head - self._count + np.arange(self._count)) % self.capacity
+    
+    def _sample(self, slot):
+        """The sample in one buffer slot as a dict (call with the lock held)."""
+        label = int(self._labels[slot])
+        return {
+            'timestamp': datetime.fromtimestamp(self._timestamps[slot]),
+            'emotion': self.EMOTIONS[label],
+            'confidence': round(float(self._scores[slot, label]), 2),
+            'all_emotions': {
+                e: round(float(score), 2) for e, score in zip(self.EMOTIONS, self._scores[slot])
+            }
+        }
+    
+    def _queue_face(self, frame):
+        """Queue the first face's classifier input; classify once the batch is full or old."""
+        now = datetime.now()
+        try:
+            _, gray_faces = preprocess_faces(self.detector, frame)
+            if gray_faces:
+                self._pending.append((now, gray_faces[0]))
+            
+            if self._pending and (len(self._pending) >= self.batch_size or
+                                  (now - self._pending[0][0]).total_seconds() >= self.max_batch_delay):
+                self._flush_batch()
+        except Exception as e:
+            # FER internals changed under us - go back to per-face detect_emotions
+            print(f"⚠️  Batched emotion classification failed, using per-frame FER: {e}")
+            self.batch_size = 1
+            self._pending = []
+            emotions_data = self.detector.detect_emotions(frame)
+            if emotions_data:
+                self._add_sample(now, emotions_data[0]['emotions'])
+    
+    def _flush_batch(self):
+        """One forward pass for every queued face; each becomes a sample stamped with its capture time."""
+        timestamps, gray_faces = zip(*self._pending)
+        self._pending = []
+        
+        # Model outputs are already in EMOTIONS order; rounded like FER's own scores
+        predictions = self.detector._classify_emotions(np.array(gray_faces))
+        self._add_samples(
+            np.array([t.timestamp() for t in timestamps]),
+            np.round(np.asarray(predictions, dtype=np.float32), 2)
+        )
+    
     def get_emotion_summary(self, duration_seconds=10):
         """
         Get aggregated emotion summary over recent time window.
@@ -164,83 +262,57 @@ class HeadlessFacialSentiment:
             dict with emotion statistics or None if no data available
         """
         with self.lock:
-            if not self.emotion_samples:
+            if self._count == 0:
                 return None
             
             # Filter samples within time window
-            now = datetime.now()
-            cutoff = now.timestamp() - duration_seconds
-            
-            recent_samples = [
-                s for s in self.emotion_samples 
-                if s['timestamp'].timestamp() >= cutoff
-            ]
+            cutoff = datetime.now().timestamp() - duration_seconds
+            slots = self._ordered_slots()
+            slots = slots[self._timestamps[slots] >= cutoff]
             
-            if not recent_samples:
+            if len(slots) == 0:
                 return None
             
-            # Calculate dominant emotion (most frequent)
-            emotion_counts = Counter([s['emotion'] for s in recent_samples])
-            dominant_emotion = emotion_counts.most_common(1)[0][0]
-            
-            # Calculate average confidence for each emotion across all samples
-            emotion_sums = {}
-            for sample in recent_samples:
-                for emotion, score in sample['all_emotions'].items():
-                    if emotion not in emotion_sums:
-                        emotion_sums[emotion] = []
-                    emotion_sums[emotion].append(score)
-            
-            emotion_averages = {
-                emotion: np.mean(scores) 
-                for emotion, scores in emotion_sums.items()
-            }
-            
-            # Calculate emotion trajectory (improving/declining/stable)
-            trajectory = self._calculate_trajectory(recent_samples)
-            
-            # Get average confidence for dominant emotion
-            dominant_confidences = [
-                s['confidence'] for s in recent_samples 
-                if s['emotion'] == dominant_emotion
-            ]
-            avg_confidence = np.mean(dominant_confidences) if dominant_confidences else 0.0
-            
-            return {
-                'dominant_emotion': dominant_emotion,
-                'confidence': avg_confidence,
-                'emotion_breakdown': emotion_averages,
-                'samples_count': len(recent_samples),
-                'emotion_trajectory': trajectory,
-                'emotion_counts': dict(emotion_counts)
-            }
+            scores = self._scores[slots]
+            labels = self._labels[slots]
+        
+        # Calculate dominant emotion (most frequent)
+        counts = np.bincount(labels, minlength=len(self.EMOTIONS))
+        dominant = int(np.argmax(counts))
+        
+        # Average confidence for each emotion across all samples
+        averages = scores.mean(axis=0)
+        
+        # Average confidence for the dominant emotion where it was dominant
+        avg_confidence = float(scores[labels == dominant, dominant].mean())
+        
+        return {
+            'dominant_emotion': self.EMOTIONS[dominant],
+            'confidence': avg_confidence,
+            'emotion_breakdown': {e: float(avg) for e, avg in zip(self.EMOTIONS, averages)},
+            'samples_count': len(slots),
+            'emotion_trajectory': self._calculate_trajectory(labels),
+            'emotion_counts': {e: int(c) for e, c in zip(self.EMOTIONS, counts) if c}
+        }
     
-    def _calculate_trajectory(self, samples):
+    def _calculate_trajectory(self, labels):
         """
         Calculate if emotions are improving, declining, or stable.
         Uses positive emotions (happy, surprise) vs negative (sad, angry, fear, disgust).
+        
+        Args:
+            labels: Dominant emotion index per sample, oldest first
         """
-        if len(samples) < 3:
+        if len(labels) < 3:
             return 'stable'
         
-        positive_emotions = {'happy', 'surprise'}
-        negative_emotions = {'sad', 'angry', 'fear', 'disgust'}
-        
-        # Split samples into first half and second half
-        mid = len(samples) // 2
-        first_half = samples[:mid]
-        second_half = samples[mid:]
-        
-        def get_positivity_score(sample_list):
-            positive_count = sum(1 for s in sample_list if s['emotion'] in positive_emotions)
-            negative_count = sum(1 for s in sample_list if s['emotion'] in negative_emotions)
-            total = len(sample_list)
-            return (positive_count - negative_count) / total if total > 0 else 0
-        
-        first_score = get_positivity_score(first_half)
-        second_score = get_positivity_score(second_half)
-        
-        diff = second_score - first_score
+        # Positivity of first half vs second half of the window
+        if NUMBA_AVAILABLE:
+            diff = float(_positivity_diff_jit(np.ascontiguousarray(labels), self.POLARITY))
+        else:
+            polarity = self.POLARITY[labels]
+            mid = len(labels) // 2
+            diff = float(polarity[mid:].mean() - polarity[:mid].mean())
         
         if diff > 0.2:
             return 'improving'
@@ -252,9 +324,9 @@ class HeadlessFacialSentiment:
     def get_latest_emotion(self):
         """Get the most recent emotion sample."""
         with self.lock:
-            if not self.emotion_samples:
+            if self._count == 0:
                 return None
-            return self.emotion_samples[-1]
+            return self._sample((self._head - 1) % self.capacity)
     
     def stop(self):
         """Stop capturing emotions and release resources."""
@@ -265,21 +337,29 @@ class HeadlessFacialSentiment:
         if self.capture_thread:
             self.capture_thread.join(timeout=2.0)
         
-        if self.cap:
-            self.cap.release()
+        # Classify faces still waiting for a full batch, so the summary keeps the last seconds
+        queued = len(self._pending)
+        if queued:
+            try:
+                self._flush_batch()
+            except Exception as e:
+                print(f"⚠️  Could not classify {queued} queued faces: {e}")
+        
+        if self.grabber:
+            self.grabber.stop()
         
         print("✅ Facial capture stopped")
     
     def get_status(self):
         """Get current status of the capture system."""
         with self.lock:
-            sample_count = len(self.emotion_samples)
-            latest = self.emotion_samples[-1] if self.emotion_samples else None
+            sample_count = self._count
+            latest = self.EMOTIONS[self._labels[(self._head - 1) % self.capacity]] if self._count else None
         
         return {
             'running': self.running,
             'total_samples': sample_count,
-            'latest_emotion': latest['emotion'] if latest else None,
+            'latest_emotion': latest,
             'last_error': self.last_error
         }
 
@@ -0,0 +1,139 @@
+"""
+Frame Grabber
+Reads the camera on a dedicated thread and always hands out the newest frame,
+so slow consumers (DeepFace, FER, JPEG encoding) never back up the camera
+buffer and never block each other.
+"""
+
+import threading
+import time
+
+import cv2
+
+
+class FrameGrabber:
+    """
+    Background camera reader holding only the latest frame.
+
+    Every frame gets an increasing sequence number. Consumers pass the last
+    number they saw to read() and block until something newer arrives, so
+    several consumers can share one camera without polling.
+    """
+
+    def __init__(self, camera_index=0, transform=None, frame_size=None, min_interval=0.0,
+                 fourcc=None, fps=None):
+        """
+        Args:
+            camera_index: Camera device index (default: 0)
+            transform: Optional function applied to each frame on the
+                       capture thread (e.g. rotation)
+            frame_size: Optional (width, height) to request from the camera
+            min_interval: Decode at most one frame per this many seconds;
+                          frames in between are grabbed (keeping the camera
+                          buffer drained) but never decoded
+            fourcc: Optional pixel format to request, e.g. 'MJPG' (compressed
+                    frames over USB, decoded by libjpeg-turbo, instead of
+                    raw YUYV)
+            fps: Optional capture rate to request from the camera
+        """
+        self.camera_index = camera_index
+        self.transform = transform
+        self.frame_size = frame_size
+        self.min_interval = min_interval
+        self.fourcc = fourcc
+        self.fps = fps
+        self.cap = None
+        self.running = False
+        self.thread = None
+        self.last_error = None
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+
+    def start(self):
+        """Open the camera and start the capture thread."""
+        if self.running:
+            return True
+
+        self.cap = cv2.VideoCapture(self.camera_index)
+        if not self.cap.isOpened():
+            self.last_error = f"Could not open camera {self.camera_index}"
+            return False
+        if self.fourcc is not None:
+            # Set before the size: some drivers only offer larger sizes in MJPG
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.frame_size is not None:
+            # Cameras that don't support the size just keep their default
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_size[1])
+        if self.fps is not None:
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Only some backends honor it
+
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, args=(self.cap,), daemon=True)
+        self.thread.start()
+        return True
+
+    def _capture_loop(self, cap):
+        """Grab frames as fast as the camera delivers them, decoding only the ones needed."""
+        last_decode = float('-inf')
+        try:
+            # A restarted grabber has a new cap; a thread left wedged on the old one just exits
+            while self.running and cap is self.cap:
+                if not cap.grab():
+                    self.last_error = "Failed to capture frame"
+                    time.sleep(0.01)
+                    continue
+
+                now = time.monotonic()
+                if now - last_decode < self.min_interval:
+                    continue  # Skip the MJPEG/YUYV decode for frames nobody will see
+
+                ret, frame = cap.retrieve()
+                if not ret or frame is None:
+                    self.last_error = "Failed to capture frame"
+                    time.sleep(0.01)
+                    continue
+                last_decode = now
+
+                if self.transform is not None:
+                    frame = self.transform(frame)
+
+                with self._cond:
+                    self._frame = frame
+                    self._seq += 1
+                    self._cond.notify_all()
+        finally:
+            cap.release()  # Here, not in stop(), so it never races a grab() still in progress
+
+    def read(self, last_seq=None, timeout=1.0):
+        """
+        Return the newest frame, waiting for one newer than `last_seq`.
+
+        Returns:
+            (seq, frame), or (last_seq, None) on timeout
+        """
+        with self._cond:
+            if last_seq is None:
+                last_seq = 0
+            if not self._cond.wait_for(lambda: self._seq > last_seq or not self.running, timeout):
+                return last_seq, None
+            if self._seq <= last_seq:
+                return last_seq, None
+            return self._seq, self._frame
+
+    def stop(self):
+        """
+        Stop the capture thread and release the camera. The capture thread
+        releases it on exit; if it is stuck in grab() past the join timeout,
+        the camera is released whenever that call returns.
+        """
+        self.running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+        if self.cap is not None and not (self.thread and self.thread.is_alive()):
+            self.cap.release()  # Thread gone (or never started); releasing twice is harmless
@@ -2,13 +2,15 @@
 """
 Launcher script to run both main.py (face recognition)
 and sales_call_analyzer.py (sales call analysis) simultaneously.
+
+Both run in this one process (face recognition on a background thread), so
+TensorFlow, OpenCV and the Supabase client are imported and initialized once
+instead of once per interpreter.
 """
 
-import subprocess
 import sys
-import os
+import threading
 import time
-from pathlib import Path
 
 def main():
     print("="*70)
@@ -31,57 +33,39 @@ def main():
     print("="*70)
     print()
 
-    # Get the directory where this script is located
-    script_dir = Path(__file__).parent
-
-    # Paths to the scripts
-    main_py = script_dir / "main.py"
-    sales_analyzer = script_dir / "sales_call_analyzer.py"
-
-    # Check if files exist
-    if not main_py.exists():
-        print(f"❌ Error: {main_py} not found!")
-        sys.exit(1)
+    # Imported here so the banner shows while TensorFlow & co. load
+    import sales_call_analyzer
+    from main import UnifiedFaceSystem
 
-    if not sales_analyzer.exists():
-        print(f"❌ Error: {sales_analyzer} not found!")
-        sys.exit(1)
-
-    # Start both processes
-    processes = []
+    face_system = None
+    face_thread = None
 
     try:
-        # Start main.py (Face Recognition) - runs in background
+        # Start face recognition - runs in background
         print("🎥 Starting Face Recognition System (main.py)...")
-        main_process = subprocess.Popen(
-            [sys.executable, str(main_py)],
-            cwd=str(script_dir),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        face_system = UnifiedFaceSystem()
+        # HighGUI windows only work on the main thread on macOS
+        show_window = sys.platform != "darwin"
+        face_thread = threading.Thread(
+            target=face_system.start_system,
+            kwargs={"show_window": show_window},
+            name="face-recognition",
+            daemon=True
         )
-        processes.append(("Face Recognition", main_process))
+        face_thread.start()
         time.sleep(2)  # Give it time to initialize
 
-        # Start sales_call_analyzer.py - runs in foreground with input access
+        # Sales call analyzer runs on the main thread with input access
         print("📞 Starting Sales Call Analyzer (sales_call_analyzer.py)...")
         print("    This will take over the terminal for keyboard input.")
         print("    Face Recognition will run in the background.\n")
-        time.sleep(1)
-        
-        analyzer_process = subprocess.Popen(
-            [sys.executable, str(sales_analyzer)],
-            cwd=str(script_dir)
-            # No stdout/stderr redirect - inherits terminal
-        )
-        processes.append(("Sales Analyzer", analyzer_process))
 
-        print()
-        print("✅ Both systems started successfully!")
         print()
         print("="*70)
         print("SYSTEM STATUS:")
-        print("  ✅ Face Recognition: RUNNING")
-        print("  ✅ Sales Analyzer: RUNNING")
+        print(f"  {'✅' if face_thread.is_alive() else '❌'} Face Recognition: "
+              f"{'RUNNING' if face_thread.is_alive() else 'STOPPED'}")
+        print("  ✅ Sales Analyzer: STARTING")
         print("="*70)
         print()
         print("📋 HOW IT WORKS:")
@@ -95,65 +79,41 @@ def main():
         print("    → This ends call gracefully and saves customer profile")
         print("  • To force stop everything: Press Ctrl+C")
         print()
-        print("💡 TIP: Face Recognition runs in background with camera window")
+        if show_window:
+            print("💡 TIP: Face Recognition runs in background with camera window")
+        else:
+            print("💡 TIP: Face Recognition runs in background (no camera window on macOS)")
         print("💡 TIP: Customer must be locked for 2+ seconds to save profile")
         print("💡 TIP: You can type 'q' anytime to end the call")
         print()
 
-        # Wait for sales analyzer to finish (it controls the terminal)
-        # Face recognition keeps running in background
-        print("📞 Sales Call Analyzer is now active...")
-        print("    (You should see its output above)")
-        print("    Type 'q' + ENTER when ready to end the call\n")
-        
-        analyzer_process.wait()  # Blocks until sales analyzer exits
-        
+        # Blocks until the call ends ('q' + ENTER); handles its own Ctrl+C.
+        # Reuses face recognition's Supabase client rather than opening a second one
+        sales_call_analyzer.main(supabase_client=face_system.supabase)
+
         print("\n✅ Sales Analyzer stopped")
-        print("🛑 Stopping Face Recognition...")
-        
-        # Stop main.py (face recognition)
-        if main_process.poll() is None:
-            main_process.terminate()
-            try:
-                main_process.wait(timeout=3)
-                print("✅ Face Recognition stopped")
-            except subprocess.TimeoutExpired:
-                main_process.kill()
-                print("✅ Face Recognition killed")
-        
-        print("\n" + "="*70)
-        print("✅ ALL SYSTEMS STOPPED")
-        print("="*70)
 
     except KeyboardInterrupt:
         print()
         print("="*70)
-        print("🛑 Ctrl+C detected - Stopping all processes...")
-        print("="*70)
-
-        # Terminate all processes
-        for name, proc in processes:
-            if proc.poll() is None:  # Still running
-                print(f"  Stopping {name}...")
-                proc.terminate()
-                try:
-                    proc.wait(timeout=5)
-                    print(f"  ✅ {name} stopped")
-                except subprocess.TimeoutExpired:
-                    print(f"  ⚠️  Force killing {name}...")
-                    proc.kill()
-
-        print()
-        print("✅ All processes stopped")
+        print("🛑 Ctrl+C detected - Stopping all components...")
         print("="*70)
 
     except Exception as e:
         print(f"❌ Error: {e}")
-        # Clean up processes
-        for name, proc in processes:
-            if proc.poll() is None:
-                proc.kill()
-        sys.exit(1)
+        sys.exit(1)  # The finally block still stops face recognition
+
+    finally:
+        # Stop face recognition (it clears active_session on the way out)
+        if face_thread is not None and face_thread.is_alive():
+            print("🛑 Stopping Face Recognition...")
+            face_system.stop()
+            face_thread.join(timeout=3)
+            print("✅ Face Recognition stopped")
+
+        print("\n" + "="*70)
+        print("✅ ALL SYSTEMS STOPPED")
+        print("="*70)
 
 if __name__ == "__main__":
     main()
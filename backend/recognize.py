@@ -1,16 +1,18 @@
 import cv2
 import os
-import pickle
-import numpy as np
-from deepface import DeepFace
+from face_embedding import FaceEmbedder
+from face_gallery import FaceGallery
+from face_tracking import FaceTracker
 import time
 
 class FaceRecognizer:
-    def __init__(self, database_path="face_database", encodings_file="face_encodings.pkl"):
+    def __init__(self, database_path="face_database", encodings_file="face_encodings.npz"):
         self.database_path = database_path
         self.encodings_file = encodings_file
-        self.known_faces = {}
+        self.known_faces = FaceGallery()
         self.model_name = "Facenet"  # Fast and accurate model
+        self.threshold = 10.0  # Threshold for recognition (adjust based on testing); lower = stricter matching
+        self.reuse_ttl = 1.5  # Seconds a face that hasn't moved keeps its last result without re-embedding
         
         # Create database directory if it doesn't exist
         if not os.path.exists(database_path):
@@ -19,44 +21,83 @@ class FaceRecognizer:
         
         # Load known faces
         self.load_encodings()
+        
+        # Model built once (ONNX Runtime session if facenet.onnx was exported)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.embedder = FaceEmbedder(self.model_name, onnx_path=os.path.join(base_dir, "facenet.onnx"))
+        
+        # YuNet CNN detector (OpenCV >= 4.8 + model file); Haar cascade otherwise
+        self.yunet_model = os.path.join(base_dir, "face_detection_yunet_2023mar.onnx")
+        self.face_detector = None
+        self.face_detector_size = None  # Input size YuNet's network is currently shaped for
+        if hasattr(cv2, 'FaceDetectorYN') and os.path.exists(self.yunet_model):
+            self.face_detector = cv2.FaceDetectorYN.create(self.yunet_model, "", (320, 320), 0.9, 0.3, 5000)
+            print("✅ Using YuNet face detector")
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
     
     def load_encodings(self):
         """Load pre-computed face encodings from file"""
-        if os.path.exists(self.encodings_file):
-            with open(self.encodings_file, 'rb') as f:
-                self.known_faces = pickle.load(f)
+        self.known_faces = FaceGallery.load(self.encodings_file)
+        if len(self.known_faces) > 0:
             print(f"Loaded {len(self.known_faces)} known faces from database")
         else:
             print("No existing face database found. Use register.py to add faces.")
     
-    def recognize_face(self, face_img):
-        """Recognize a face using DeepFace"""
+    def recognize_faces(self, face_imgs):
+        """
+        Recognize every face crop of a frame with one batched forward pass.
+        Returns a list of (name, distance), parallel to `face_imgs`.
+        """
+        results = [("Unknown", float('inf'))] * len(face_imgs)
+        indices, face_tensors = [], []
+        for i, face_img in enumerate(face_imgs):
+            try:
+                # Same preprocessing as DeepFace.represent (align, resize, scale)
+                face_tensors.append(self.embedder.preprocess(face_img))
+                indices.append(i)
+            except Exception:
+                pass
+        if not face_tensors:
+            return results
+        
         try:
-            # Get embedding for the detected face
-            embedding = DeepFace.represent(face_img, model_name=self.model_name, enforce_detection=False)[0]["embedding"]
-            
-            # Compare with known faces
-            min_distance = float('inf')
-            recognized_name = "Unknown"
-            
-            for name, known_embedding in self.known_faces.items():
-                # Calculate Euclidean distance
-                distance = np.linalg.norm(np.array(embedding) - np.array(known_embedding))
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    recognized_name = name
-            
-            # Threshold for recognition (adjust based on testing)
-            threshold = 10.0  # Lower = stricter matching
-            
-            if min_distance < threshold:
-                return recognized_name, min_distance
-            else:
-                return "Unknown", min_distance
-                
+            embeddings = self.embedder.embed_batch(face_tensors)
         except Exception as e:
-            return "Unknown", float('inf')
+            print(f"Error computing embeddings: {e}")
+            return results
+        
+        # Compare with known faces: one vectorized pass over the gallery's
+        # float32 matrix for all faces at once
+        matches = self.known_faces.nearest_batch(embeddings)
+        for i, (recognized_name, min_distance) in zip(indices, matches):
+            if min_distance < self.threshold:
+                results[i] = (recognized_name, min_distance)
+            else:
+                results[i] = ("Unknown", min_distance)
+        return results
+    
+    def recognize_face(self, face_img):
+        """Recognize a single face"""
+        return self.recognize_faces([face_img])[0]
+    
+    def detect_faces(self, frame):
+        """Face boxes (x, y, w, h): YuNet if loaded, else Haar"""
+        if self.face_detector is not None:
+            size = (frame.shape[1], frame.shape[0])
+            if size != self.face_detector_size:  # Reshaping the network is not free
+                self.face_detector.setInputSize(size)
+                self.face_detector_size = size
+            _, detections = self.face_detector.detect(frame)
+            if detections is None:
+                return []
+            # YuNet boxes can start slightly off-frame
+            return [
+                tuple(max(0, int(v)) for v in det[:4]) for det in detections
+                if det[2] >= 50 and det[3] >= 50
+            ]
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
     
     def start_recognition(self):
         """Start real-time face recognition from webcam"""
@@ -74,49 +115,65 @@ class FaceRecognizer:
             print("Error: Could not open webcam")
             return
         
-        # Load face detector
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
         frame_count = 0
         process_every_n_frames = 10  # Process every 10th frame for better performance
-        last_recognition = {}
+        display_every_n_frames = 2  # Only these frames are decoded; divides process_every_n_frames
+        last_recognition = {}  # track_id -> (name, distance, time recognized)
+        # A face whose box overlaps its last one by IoU > 0.7 keeps its track id
+        tracker = FaceTracker(iou_threshold=0.7, max_age=self.reuse_ttl)
         
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            # grab() every frame so the camera never backs up, but only pay for
+            # the decode on frames that are shown (and so also on processed ones)
+            if not cap.grab():
                 print("Error: Failed to capture frame")
                 break
             
             frame_count += 1
+            if frame_count % display_every_n_frames != 0:
+                continue
             
-            # Convert to grayscale for face detection
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            ret, frame = cap.retrieve()
+            if not ret:
+                print("Error: Failed to capture frame")
+                break
             
             # Detect faces
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
+            faces = self.detect_faces(frame)
+            
+            track_ids = tracker.update(faces)
+            for track_id in list(last_recognition):
+                if track_id not in tracker.tracks:
+                    del last_recognition[track_id]
             
             # Process faces
             if frame_count % process_every_n_frames == 0 and len(faces) > 0:
-                for i, (x, y, w, h) in enumerate(faces):
-                    # Extract face region
-                    face_img = frame[y:y+h, x:x+w]
-                    
-                    # Recognize face
-                    name, distance = self.recognize_face(face_img)
-                    
+                # Faces that barely moved since a recent recognition keep its result
+                now = time.time()
+                stale = [
+                    i for i, track_id in enumerate(track_ids)
+                    if track_id not in last_recognition or now - last_recognition[track_id][2] >= self.reuse_ttl
+                ]
+                
+                # Extract face regions
+                face_imgs = [frame[y:y+h, x:x+w] for (x, y, w, h) in (faces[i] for i in stale)]
+                
+                # Recognize faces
+                for i, (name, distance) in zip(stale, self.recognize_faces(face_imgs)):
                     # Store result
-                    last_recognition[i] = (name, distance)
+                    last_recognition[track_ids[i]] = (name, distance, now)
                     
                     # Print to terminal
                     print(f"\r[DETECTED] {name} (confidence: {distance:.2f})    ", end='', flush=True)
             
             # Draw rectangles and labels on frame
             for i, (x, y, w, h) in enumerate(faces):
-                color = (0, 255, 0) if i in last_recognition and last_recognition[i][0] != "Unknown" else (0, 0, 255)
+                result = last_recognition.get(track_ids[i])
+                color = (0, 255, 0) if result is not None and result[0] != "Unknown" else (0, 0, 255)
                 cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
                 
-                if i in last_recognition:
-                    name, distance = last_recognition[i]
+                if result is not None:
+                    name, distance, _ = result
                     label = f"{name} ({distance:.1f})"
                     cv2.putText(frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
             
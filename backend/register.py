@@ -1,10 +1,10 @@
 import cv2
 import os
-import pickle
-from deepface import DeepFace
+from face_embedding import FaceEmbedder
+from face_gallery import FaceGallery
 
 class FaceRegistration:
-    def __init__(self, database_path="face_database", encodings_file="face_encodings.pkl"):
+    def __init__(self, database_path="face_database", encodings_file="face_encodings.npz"):
         self.database_path = database_path
         self.encodings_file = encodings_file
         self.model_name = "Facenet"
@@ -14,10 +14,11 @@ class FaceRegistration:
             os.makedirs(database_path)
         
         # Load existing encodings
-        self.known_faces = {}
-        if os.path.exists(encodings_file):
-            with open(encodings_file, 'rb') as f:
-                self.known_faces = pickle.load(f)
+        self.known_faces = FaceGallery.load(encodings_file)
+        
+        # Model built once for every registration in this session
+        onnx_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "facenet.onnx")
+        self.embedder = FaceEmbedder(self.model_name, onnx_path=onnx_path)
     
     def capture_face(self, name):
         """Capture a face from webcam and register it"""
@@ -79,14 +80,10 @@ class FaceRegistration:
             print("Computing face embedding...")
             
             # Get face embedding
-            embedding = DeepFace.represent(face_img, model_name=self.model_name, enforce_detection=False)[0]["embedding"]
-            
-            # Save to database
-            self.known_faces[name] = embedding
+            embedding = self.embedder.represent(face_img)
             
-            # Save encodings to file
-            with open(self.encodings_file, 'wb') as f:
-                pickle.dump(self.known_faces, f)
+            # Save to database (journaled to the encodings file)
+            self.known_faces.add(name, embedding)
             
             # Save face image
             img_path = os.path.join(self.database_path, f"{name}.jpg")
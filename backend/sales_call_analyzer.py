@@ -36,7 +36,7 @@ class SalesCallAnalyzer:
     def __init__(self, gemini_api_key: str, model_size: str = "base",
                  camera_index: int = 0, enable_facial: bool = True,
                  supabase_url: str = None, supabase_key: str = None,
-                 customer_id: str = None):
+                 customer_id: str = None, supabase_client=None):
         """
         Initialize the sales call analyzer.
 
@@ -48,14 +48,15 @@ class SalesCallAnalyzer:
             supabase_url: Supabase project URL (optional)
             supabase_key: Supabase API key (optional)
             customer_id: Customer identifier from face recognition (optional)
+            supabase_client: Already-created Supabase client to share (optional)
         """
         # Set API key in environment for genai.Client()
         os.environ["GEMINI_API_KEY"] = gemini_api_key
         self.client = genai.Client()
 
         # Initialize Supabase client (optional)
-        self.supabase = None
-        if supabase_url and supabase_key:
+        self.supabase = supabase_client
+        if self.supabase is None and supabase_url and supabase_key:
             try:
                 self.supabase = create_client(supabase_url, supabase_key)
                 print("✅ Supabase client initialized")
@@ -794,9 +795,12 @@ JSON OUTPUT:"""
             print(f"❌ Error saving to Supabase: {e}")
 
 
-def main():
+def main(supabase_client=None):
     """
     Main function to run the sales call analyzer.
+
+    Args:
+        supabase_client: Supabase client shared by the launcher (optional)
     """
     # Get API key from .env file or environment
     api_key = os.getenv("GEMINI_API_KEY")
@@ -837,7 +841,8 @@ def main():
         camera_index=0,  # Change camera index if needed
         enable_facial=True,  # Set to False to disable facial sentiment
         supabase_url=supabase_url,
-        supabase_key=supabase_key
+        supabase_key=supabase_key,
+        supabase_client=supabase_client
     )
     
     try:
@@ -0,0 +1,62 @@
+"""
+Speech Worker
+Microphone capture and Google transcription for app.py, run as a separate
+process so audio processing never competes with face recognition for the GIL.
+
+Writes one JSON message per line to stdout - {"text": ..., "timestamp": ...}
+or {"error": ...} - and logs to stderr. Runs until the parent terminates it.
+"""
+
+import json
+import sys
+import time
+
+import speech_recognition as sr
+
+
+def emit(data):
+    """Send one message to the parent process"""
+    print(json.dumps(data), flush=True)
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def main():
+    recognizer = sr.Recognizer()
+    recognizer.energy_threshold = 300
+    recognizer.dynamic_energy_threshold = True
+
+    try:
+        microphone = sr.Microphone(device_index=None)
+        with microphone as source:
+            log("[SPEECH] Adjusting for ambient noise...")
+            recognizer.adjust_for_ambient_noise(source, duration=1)
+            log(f"[SPEECH] Ready! Energy threshold: {recognizer.energy_threshold}")
+    except Exception as e:
+        log(f"[SPEECH ERROR] Could not initialize microphone: {e}")
+        emit({"error": str(e)})
+        return
+
+    while True:
+        try:
+            with microphone as source:
+                audio = recognizer.listen(source, timeout=None, phrase_time_limit=10)
+                log("[SPEECH] Audio detected, processing...")
+
+            try:
+                text = recognizer.recognize_google(audio)
+                log(f"[SPEECH] Transcribed: {text}")
+                emit({"text": text, "timestamp": time.time()})
+            except sr.UnknownValueError:
+                log("[SPEECH] Could not understand audio")
+            except sr.RequestError as e:
+                log(f"[SPEECH ERROR] Recognition error: {e}")
+                emit({"error": str(e)})
+        except Exception as e:
+            log(f"[SPEECH ERROR] Listening error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -291,9 +291,9 @@ function App() {
             faces.map((face) => (
               <div key={face.name} className="face-card-compact">
                 <div className="face-image-container-compact" onClick={() => openFaceModal(face)}>
-                  {face.image ? (
+                  {face.url ? (
                     <img 
-                      src={`data:image/jpeg;base64,${face.image}`} 
+                      src={`${API_URL}${face.url}`} 
                       alt={face.name}
                       className="face-image-compact"
                     />
@@ -322,9 +322,9 @@ function App() {
             
             <div className="modal-body">
               <div className="modal-face-preview">
-                {selectedFace.image ? (
+                {selectedFace.url ? (
                   <img 
-                    src={`data:image/jpeg;base64,${selectedFace.image}`} 
+                    src={`${API_URL}${selectedFace.url}`} 
                     alt={selectedFace.name}
                     className="modal-face-image"
                   />